@@ -0,0 +1,78 @@
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+
+from .executor import LANE_ANNOUNCE, LANE_DELETE, LANE_PUNISH, LANE_ROLE
+from .plan import RulePlan
+
+# least to most severe, a message only gets the most severe action of the rules it broke
+SEVERITY = {
+    "third_party": 0,
+    "message": 1,
+    "add_role": 2,
+    "kick": 3,
+    "ban": 4,
+}
+
+
+@dataclass(frozen=True)
+class ActionPlan:
+    """Everything to do about one message, merged from every rule it broke"""
+
+    rules: Tuple
+    rule_plans: Tuple[RulePlan, ...]
+    action_to_take: str
+    # the rule whose action is taken
+    action_plan: RulePlan
+    delete_message: bool
+    role_to_add: Optional[int]
+    # the author's strike score after this message, 0 when strikes are off
+    strikes: float = 0.0
+    # minutes of the author's recent messages to purge, the longest of the rules broken
+    purge_minutes: int = 0
+
+    @classmethod
+    def from_hits(cls, hits: [tuple]) -> "ActionPlan":
+        """`hits` is a list of (rule, rule plan) in the order they were found"""
+        rule_plans = tuple(rule_plan for _, rule_plan in hits)
+        # max keeps the first of equally severe rules
+        action_plan = max(rule_plans, key=lambda p: SEVERITY.get(p.action_to_take, 0))
+        return cls(
+            rules=tuple(rule for rule, _ in hits),
+            rule_plans=rule_plans,
+            action_to_take=action_plan.action_to_take,
+            action_plan=action_plan,
+            delete_message=any(p.delete_message for p in rule_plans),
+            role_to_add=action_plan.role_to_add,
+            purge_minutes=max(p.purge_minutes for p in rule_plans),
+        )
+
+    def escalate(self, action: str, strikes: float, role_to_add: Optional[int] = None) -> "ActionPlan":
+        """The plan with a more severe action, escalated plans always delete the message"""
+        if SEVERITY.get(action, 0) <= self.severity:
+            return replace(self, strikes=strikes)
+        return replace(
+            self,
+            action_to_take=action,
+            delete_message=True,
+            role_to_add=role_to_add or self.role_to_add,
+            strikes=strikes,
+        )
+
+    @property
+    def rule_names(self) -> [str]:
+        return [rule.rule_name for rule in self.rules]
+
+    @property
+    def severity(self) -> int:
+        return SEVERITY.get(self.action_to_take, 0)
+
+    @property
+    def lane(self) -> int:
+        """Executor lane of the most urgent thing this plan does"""
+        if self.action_to_take in ("kick", "ban"):
+            return LANE_PUNISH
+        if self.delete_message or self.purge_minutes:
+            return LANE_DELETE
+        if self.action_to_take == "add_role":
+            return LANE_ROLE
+        return LANE_ANNOUNCE
@@ -0,0 +1,82 @@
+from functools import cached_property
+from typing import Optional
+import re
+
+import discord
+
+from .normalize import fold, normalize
+
+MENTION_RE = re.compile(r"<@!?(\d+)>")
+INVITE_RE = re.compile(
+    r"(https?://)?(www\.)?((discordapp\.com/invite)|(discord\.gg))/(\w+)", re.IGNORECASE
+)
+
+
+def invite_code(link: str) -> Optional[str]:
+    """Code of a discord invite link in any of its forms, None when it isn't one"""
+    match = INVITE_RE.match(fold(link))
+    return match.group(6) if match else None
+
+
+class MessageAnalysis:
+    """
+    Derived views of a message's content, shared by every rule evaluating the message.
+
+    Each attribute is computed the first time a rule asks for it and then reused,
+    so content is only split, lowered or scanned once per message.
+    """
+
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self.content = message.content
+
+    @cached_property
+    def tokens(self) -> [str]:
+        return self.content.split()
+
+    @cached_property
+    def word_count(self) -> int:
+        return len(self.tokens)
+
+    @cached_property
+    def lowered(self) -> str:
+        return self.content.lower()
+
+    @cached_property
+    def without_mentions(self) -> str:
+        """Lowered content with user mentions removed"""
+        return MENTION_RE.sub("", self.lowered)
+
+    @cached_property
+    def folded(self) -> str:
+        """Content without invisible characters or accents and with lookalike letters mapped to latin"""
+        return fold(self.content)
+
+    @cached_property
+    def normalized(self) -> str:
+        """Content without mentions, run through the full evasion normalization"""
+        return normalize(self.without_mentions)
+
+    @cached_property
+    def normalized_tokens(self) -> [str]:
+        return self.normalized.split()
+
+    @cached_property
+    def mention_ids(self) -> [int]:
+        """User ids of every token that starts with a mention"""
+        ids = []
+        for token in self.tokens:
+            match = MENTION_RE.match(token)
+            if match:
+                ids.append(int(match.group(1)))
+        return ids
+
+    @cached_property
+    def invites(self) -> [str]:
+        """Tokens that are discord invite links, checked on folded content to catch hidden characters"""
+        return [token for token in self.folded.split() if INVITE_RE.match(token)]
+
+    @cached_property
+    def invite_codes(self) -> [str]:
+        """Codes of `invites`, the same invite posted as another kind of link has the same code"""
+        return [INVITE_RE.match(token).group(6) for token in self.invites]
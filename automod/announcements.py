@@ -0,0 +1,173 @@
+"""
+Announcement digests.
+
+The first infraction after a quiet period is announced right away. Infractions that follow within
+the guild's digest window are held back and sent together when the window closes, one embed
+with a line per offender instead of one embed per message.
+"""
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+import asyncio
+import logging
+import time
+
+import discord
+
+log = logging.getLogger("red.breadcogs.automod.announcements")
+
+Announcement = namedtuple(
+    "Announcement", "embed author rule_names action_taken action_taken_success deleted channel_id"
+)
+
+# discord allows 25 fields per embed, the last one is kept for the overflow line
+MAX_DIGEST_FIELDS = 24
+# discord limits the text of an embed to 6000 characters, room is kept for the overflow line
+MAX_DIGEST_LENGTH = 6000 - 100
+MAX_DIGEST_CHANNELS = 5
+
+
+def channel_mentions(channel_ids: [int]) -> str:
+    mentions = ", ".join(f"<#{c}>" for c in channel_ids[:MAX_DIGEST_CHANNELS])
+    if len(channel_ids) > MAX_DIGEST_CHANNELS:
+        mentions += f" and {len(channel_ids) - MAX_DIGEST_CHANNELS} more"
+    return mentions
+
+
+def digest_embed(announcements: [Announcement], window: float) -> discord.Embed:
+    """One embed summarising announcements, offenders are listed by number of infractions"""
+    offenders = {}
+    for announcement in announcements:
+        offenders.setdefault(announcement.author.id, []).append(announcement)
+
+    embed = discord.Embed(
+        title=f"AutoMod digest - {len(announcements)} offenses found",
+        description=f"{len(offenders)} members in the last {window:g} seconds.",
+        color=discord.Color.gold(),
+    )
+    ranked = sorted(offenders.values(), key=len, reverse=True)
+    length = len(embed.title) + len(embed.description)
+    shown = 0
+    for entries in ranked[:MAX_DIGEST_FIELDS]:
+        rules = {}
+        for entry in entries:
+            for rule_name in entry.rule_names:
+                rules[rule_name] = rules.get(rule_name, 0) + 1
+        actions = {entry.action_taken for entry in entries if entry.action_taken}
+        failed = sum(1 for entry in entries if not entry.action_taken_success)
+        deleted = sum(1 for entry in entries if entry.deleted)
+        channels = list(dict.fromkeys(entry.channel_id for entry in entries))
+
+        value = ", ".join(f"`{name}` ×{count}" for name, count in rules.items())
+        if actions:
+            value += f"\nAction: {', '.join(f'`{a}`' for a in sorted(actions))}"
+            if failed:
+                value += f" ({failed} failed, check logs)"
+        value = (value + f"\nDeleted {deleted}/{len(entries)} in {channel_mentions(channels)}")[:1024]
+
+        author = entries[0].author
+        name = f"{author} - {author.id} (×{len(entries)})"
+        if length + len(name) + len(value) > MAX_DIGEST_LENGTH:
+            break
+        embed.add_field(name=name, value=value, inline=False)
+        length += len(name) + len(value)
+        shown += 1
+
+    rest = ranked[shown:]
+    if rest:
+        embed.add_field(
+            name="And more",
+            value=f"{len(rest)} more members with {sum(len(e) for e in rest)} offenses.",
+            inline=False,
+        )
+    embed.timestamp = datetime.now()
+    return embed
+
+
+class AnnouncementDigest:
+    """
+    Collects announcements per guild
+
+    `submit(guild_id, job)` schedules the send of a flushed digest, the announcement channel
+    of every guild is resolved once and kept until it changes or disappears.
+    """
+
+    def __init__(self, submit):
+        self.submit = submit
+        self._buffers = {}
+        self._tasks = {}
+        self._last_sent = {}
+        # guild id -> (channel id, channel)
+        self._channels = {}
+        self.received = 0
+        self.sent = 0
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "sent": self.sent,
+            "pending": sum(len(buffer) for buffer in self._buffers.values()),
+        }
+
+    def channel(self, guild: discord.Guild, channel_id: int) -> discord.TextChannel:
+        cached = self._channels.get(guild.id)
+        if cached is not None and cached[0] == channel_id:
+            return cached[1]
+        channel = guild.get_channel(channel_id)
+        if channel is not None:
+            self._channels[guild.id] = (channel_id, channel)
+        return channel
+
+    def forget_channel(self, channel_id: int) -> None:
+        for guild_id, (cached_id, _) in list(self._channels.items()):
+            if cached_id == channel_id:
+                del self._channels[guild_id]
+
+    async def send(self, guild: discord.Guild, channel_id: int, embed: discord.Embed) -> None:
+        channel = self.channel(guild, channel_id)
+        if channel is None:
+            log.info(f"Announcement channel {channel_id} of {guild} ({guild.id}) no longer exists")
+            return
+        try:
+            await channel.send(embed=embed)
+            self.sent += 1
+        except discord.NotFound:
+            self.forget_channel(channel_id)
+        except discord.Forbidden:
+            log.warning(f"Missing permissions to announce in {channel} ({channel_id})")
+        except discord.HTTPException:
+            log.exception(f"Failed to announce in {channel} ({channel_id})")
+
+    async def add(
+        self, guild: discord.Guild, channel_id: int, window: float, announcement: Announcement,
+    ) -> None:
+        """Sends announcement now, or holds it for the digest when the guild is busy"""
+        self.received += 1
+        now = time.monotonic()
+        buffer = self._buffers.get(guild.id)
+        if buffer is None:
+            since_last = now - self._last_sent.get(guild.id, float("-inf"))
+            if not window or since_last >= window:
+                self._last_sent[guild.id] = now
+                return await self.send(guild, channel_id, announcement.embed)
+            buffer = self._buffers[guild.id] = []
+            self._tasks[guild.id] = asyncio.create_task(
+                self._flush_later(guild, channel_id, window, window - since_last)
+            )
+        buffer.append(announcement)
+
+    async def _flush_later(self, guild: discord.Guild, channel_id: int, window: float, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._tasks.pop(guild.id, None)
+        buffer = self._buffers.pop(guild.id, [])
+        if not buffer:
+            return
+        self._last_sent[guild.id] = time.monotonic()
+        embed = buffer[0].embed if len(buffer) == 1 else digest_embed(buffer, window)
+        self.submit(guild.id, partial(self.send, guild, channel_id, embed))
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._buffers.clear()
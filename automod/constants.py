@@ -20,6 +20,34 @@ DEFAULT_OPTIONS = {
     "is_enabled": False,
     "delete_message": False,
     "send_dm": False,
+    "purge_minutes": 0,
+}
+
+# furthest back an offender's messages can be purged
+MAX_PURGE_MINUTES = 60
+
+# seconds infractions after an announcement are collected into one digest, 0 announces every infraction
+DEFAULT_DIGEST_WINDOW = 10
+
+DEFAULT_RAID_SETTINGS = {
+    "enabled": False,
+    # joins within seconds
+    "join_limit": [10, 60],
+    # joins within the same window of accounts younger than young_age seconds
+    "young_limit": 5,
+    "young_age": 86400,
+    # seconds the raid state lasts after the last join that tripped it
+    "duration": 600,
+}
+
+DEFAULT_STRIKE_SETTINGS = {
+    "enabled": False,
+    # seconds for a strike score to halve
+    "half_life": 3600,
+    # strike score at which an action is taken, 0 skips the step
+    "thresholds": {"delete": 1, "add_role": 3, "kick": 5, "ban": 8},
+    # role for the add_role step, falls back to the role of the rule that fired
+    "role": None,
 }
 
 OPTIONS_MAP = {
@@ -32,4 +60,5 @@ OPTIONS_MAP = {
     "is_enabled": "Enabled",
     "delete_message": "Delete message",
     "send_dm": "DM User",
+    "purge_minutes": "Purge author (minutes)",
 }
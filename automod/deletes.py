@@ -0,0 +1,122 @@
+"""
+Batches message deletions per channel.
+
+During a spam wave every offending message used to be deleted with its own request, which
+runs into the per channel delete rate limit fast. Deletions queued within `window` seconds
+are sent as one bulk delete instead.
+"""
+import asyncio
+import datetime
+import logging
+
+import discord
+
+log = logging.getLogger("red.breadcogs.automod.deletes")
+
+# discord refuses bulk deletes of more messages or of messages older than this
+BULK_LIMIT = 100
+BULK_MAX_AGE = datetime.timedelta(days=14)
+
+
+def _resolve(future: asyncio.Future, error: Exception = None) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class DeleteBatcher:
+    __slots__ = ("window", "_pending", "_tasks", "requested", "api_calls")
+
+    def __init__(self, window: float = 0.5):
+        self.window = window
+        # channel id -> [(message, future)]
+        self._pending = {}
+        self._tasks = {}
+        self.requested = 0
+        self.api_calls = 0
+
+    def stats(self) -> dict:
+        return {
+            "requested": self.requested,
+            "api_calls": self.api_calls,
+            "saved": max(self.requested - self.api_calls, 0),
+            "pending": sum(len(batch) for batch in self._pending.values()),
+        }
+
+    def queue(self, message: discord.Message) -> asyncio.Future:
+        """
+        Queues message for deletion without waiting for it
+
+        The returned future fails with the same errors as `message.delete()`
+        """
+        self.requested += 1
+        future = asyncio.get_running_loop().create_future()
+        channel_id = message.channel.id
+        batch = self._pending.setdefault(channel_id, [])
+        batch.append((message, future))
+
+        if len(batch) >= BULK_LIMIT:
+            self._flush_now(channel_id)
+        elif channel_id not in self._tasks:
+            self._tasks[channel_id] = asyncio.create_task(self._flush_later(channel_id))
+        return future
+
+    async def delete(self, message: discord.Message) -> None:
+        """Queues message for deletion and waits until it is gone"""
+        await self.queue(message)
+
+    def _flush_now(self, channel_id: int) -> None:
+        task = self._tasks.pop(channel_id, None)
+        if task is not None:
+            task.cancel()
+        batch = self._pending.pop(channel_id, [])
+        asyncio.create_task(self._flush(batch))
+
+    async def _flush_later(self, channel_id: int) -> None:
+        await asyncio.sleep(self.window)
+        self._tasks.pop(channel_id, None)
+        await self._flush(self._pending.pop(channel_id, []))
+
+    async def _flush(self, batch: [tuple]) -> None:
+        cutoff = datetime.datetime.utcnow() - BULK_MAX_AGE
+        bulk = [(m, f) for m, f in batch if m.created_at > cutoff]
+        single = [(m, f) for m, f in batch if m.created_at <= cutoff]
+
+        if len(bulk) > 1:
+            channel = bulk[0][0].channel
+            self.api_calls += 1
+            try:
+                await channel.delete_messages([m for m, _ in bulk])
+            except discord.Forbidden as e:
+                for _, future in bulk:
+                    _resolve(future, e)
+            except discord.HTTPException:
+                # one message already gone fails the whole bulk request, retry them one by one
+                log.debug(f"Bulk delete of {len(bulk)} messages in {channel.id} failed, falling back")
+                single.extend(bulk)
+            else:
+                for _, future in bulk:
+                    _resolve(future)
+        else:
+            single.extend(bulk)
+
+        for message, future in single:
+            self.api_calls += 1
+            try:
+                await message.delete()
+            except discord.HTTPException as e:
+                _resolve(future, e)
+            else:
+                _resolve(future)
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        for batch in self._pending.values():
+            for _, future in batch:
+                future.cancel()
+        self._pending.clear()
@@ -0,0 +1,171 @@
+"""
+Runs moderation actions off the message listener.
+
+Jobs are queued per guild in priority lanes and a small pool of workers serves guilds round
+robin, one job of a guild at a time. A guild stuck on rate limits therefore holds at most one
+worker, and within a guild bans and kicks always go before deletes, roles and announcements.
+"""
+from collections import deque
+from typing import Awaitable, Callable
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("red.breadcogs.automod.executor")
+
+LANE_PUNISH = 0
+LANE_DELETE = 1
+LANE_ROLE = 2
+LANE_ANNOUNCE = 3
+LANE_NAMES = ("punish", "delete", "role", "announce")
+
+
+class ActionExecutor:
+    """
+    Bounded, fair queue of action jobs
+
+    A job is a zero argument callable returning an awaitable. A guild can hold at most
+    `max_per_guild` jobs and the whole queue `max_size`. When either is full a queued job of a
+    lower lane makes room for the new one, taken from the guild itself when it hit its own cap
+    or else from the guild with the biggest backlog, otherwise the new job is dropped.
+    """
+
+    def __init__(self, workers: int = 4, max_size: int = 10_000, max_per_guild: int = 1_000):
+        self.workers = workers
+        self.max_size = max_size
+        self.max_per_guild = max_per_guild
+        # guild id -> one deque of (queued at, job) per lane
+        self._queues = {}
+        # guilds queued in `_ready` or being worked on
+        self._active = set()
+        self._ready = None
+        self._tasks = []
+        self.size = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wait_avg = [0.0] * len(LANE_NAMES)
+        self.wait_max = [0.0] * len(LANE_NAMES)
+
+    def stats(self) -> dict:
+        depth = [0] * len(LANE_NAMES)
+        for lanes in self._queues.values():
+            for lane, jobs in enumerate(lanes):
+                depth[lane] += len(jobs)
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "guilds": len(self._active),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "lanes": {
+                name: {"depth": depth[i], "wait_avg": self.wait_avg[i], "wait_max": self.wait_max[i]}
+                for i, name in enumerate(LANE_NAMES)
+            },
+        }
+
+    def _start(self) -> None:
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, guild_id: int, lane: int, job: Callable[[], Awaitable]) -> bool:
+        """Queues job, returns False when it was dropped because the queue is full"""
+        if self._ready is None:
+            self._start()
+
+        lanes = self._queues.get(guild_id)
+        if lanes is None:
+            lanes = self._queues[guild_id] = tuple(deque() for _ in LANE_NAMES)
+
+        victim = None
+        if sum(map(len, lanes)) >= self.max_per_guild:
+            # a guild stuck on rate limits only ever crowds out its own jobs
+            victim = next((jobs for jobs in reversed(lanes[lane + 1 :]) if jobs), None)
+            if victim is None:
+                return self._drop(guild_id, lane)
+        elif self.size >= self.max_size:
+            victim = self._victim(guild_id, lane)
+            if victim is None:
+                return self._drop(guild_id, lane)
+
+        if victim is not None:
+            victim.pop()
+            self.dropped += 1
+            self.size -= 1
+
+        lanes[lane].append((time.monotonic(), job))
+        self.size += 1
+        if guild_id not in self._active:
+            self._active.add(guild_id)
+            self._ready.put_nowait(guild_id)
+        return True
+
+    def _drop(self, guild_id: int, lane: int) -> bool:
+        self.dropped += 1
+        log.warning(f"Action queue is full, dropped a {LANE_NAMES[lane]} job for guild {guild_id}")
+        if guild_id not in self._active:
+            del self._queues[guild_id]
+        return False
+
+    def _victim(self, guild_id: int, lane: int):
+        """
+        Jobs whose newest makes room for a new `lane` job of guild, None when the new job is dropped
+
+        Only the least urgent lane anything is queued in gives up jobs, from the guild with the most
+        jobs queued there. A job never makes room in its own lane unless that guild has more queued.
+        """
+        lowest = max(
+            (queued_lane for lanes in self._queues.values() for queued_lane, jobs in enumerate(lanes) if jobs),
+            default=-1,
+        )
+        if lowest < lane:
+            return None
+        backlog, victim_id = max(
+            (len(lanes[lowest]), victim_id) for victim_id, lanes in self._queues.items() if lanes[lowest]
+        )
+        if lowest == lane and backlog <= len(self._queues[guild_id][lane]) + 1:
+            return None
+        return self._queues[victim_id][lowest]
+
+    def _next_job(self, guild_id: int):
+        for lane, jobs in enumerate(self._queues[guild_id]):
+            if jobs:
+                self.size -= 1
+                queued_at, job = jobs.popleft()
+                return lane, queued_at, job
+        return None
+
+    async def _work(self) -> None:
+        while True:
+            guild_id = await self._ready.get()
+            entry = self._next_job(guild_id)
+            if entry is not None:
+                lane, queued_at, job = entry
+                waited = time.monotonic() - queued_at
+                self.wait_avg[lane] += (waited - self.wait_avg[lane]) * 0.05
+                self.wait_max[lane] = max(self.wait_max[lane], waited)
+                try:
+                    await job()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.failed += 1
+                    log.exception(f"Action job failed in guild {guild_id}")
+                self.processed += 1
+
+            if any(self._queues[guild_id]):
+                # back of the line so other guilds get their turn
+                self._ready.put_nowait(guild_id)
+            else:
+                self._active.discard(guild_id)
+                del self._queues[guild_id]
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queues.clear()
+        self._active.clear()
+        self._ready = None
+        self.size = 0
@@ -7,6 +7,7 @@ from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
 from .constants import *
 from .utils import *
 from .converters import ToggleBool
+from .rules.wordfilter import MAX_FUZZY_DISTANCE
 from tabulate import tabulate
 
 groups = {
@@ -34,8 +35,9 @@ class GroupCommands:
         """
         Detects if a word matches list of forbidden words.
 
-        This has an optional attribute of `is_cleaned` which will attempt to remove all punctuation from the word
-        in sentence. This can aid against people attempting to evade, example: `f.ilte.red`
+        This has an optional attribute of `is_cleaned` which will normalize the sentence before checking it:
+        punctuation, invisible characters and accents are removed, lookalike letters and leetspeak are mapped back
+        and repeated letters are collapsed. This can aid against people attempting to evade, example: `f.ilte.red`
         """
         pass
 
@@ -61,7 +63,7 @@ class GroupCommands:
         """Remove a word from the list of filtered words"""
         current_filtered = await self.wordfilterrule.get_filtered_words(ctx.guild)
         current_filtered = [x['word'] for x in current_filtered]
-        if word not in current_filtered:
+        if word not in current_filtered and word.lower() not in current_filtered:
             return await ctx.send(await error_message(f"`{word}` is not being filtered."))
 
         await self.wordfilterrule.remove_filter(ctx.guild, word)
@@ -91,7 +93,9 @@ class GroupCommands:
                     table = [
                         [(f"Word     : [{word['word']}]\n"
                          f"Added by : [{self.bot.get_user(word['author'])}]\n"
-                         f"Cleaned  : [{word['is_cleaned']}]\n"), chans],
+                         f"Cleaned  : [{word['is_cleaned']}]\n"
+                         f"Fuzzy    : [{word.get('fuzzy', 0)}]\n"
+                         f"Regex    : [{word.get('is_regex', False)}]\n"), chans],
 
                     ]
                     tab = box(tabulate(table, ['Meta', 'Channels'], tablefmt="presto"), "ini")
@@ -106,7 +110,7 @@ class GroupCommands:
                 return await ctx.send("There is currently no words being filtered.")
         else:
             try:
-                current_word = [x for x in current_filtered if x['word'] == word.lower()][0]
+                current_word = [x for x in current_filtered if x['word'] in (word, word.lower())][0]
                 channels = current_word['channel']
                 chans = "\n".join('#{0}'.format(ctx.guild.get_channel(w)) for w in channels) if channels else '[Global]'
                 author = self.bot.get_user(current_word['author']) or 'Not found user.'
@@ -114,6 +118,8 @@ class GroupCommands:
                                       description=box(
                                           f"Word    : [{current_word['word']}]\n"
                                           f"Cleaned : [{current_word['is_cleaned']}]\n"
+                                          f"Fuzzy   : [{current_word.get('fuzzy', 0)}]\n"
+                                          f"Regex   : [{current_word.get('is_regex', False)}]\n"
                                           f"Added by: [{author}]\n"
                                           f"--------\n"
                                           f"Channels\n"
@@ -129,22 +135,26 @@ class GroupCommands:
         pass
 
     @add_word_to_filter.command(name="channel")
-    async def _add_to_channels(self, ctx, word: str, channels: Greedy[discord.TextChannel] = None, is_cleaned: bool = False):
+    async def _add_to_channels(
+        self, ctx, word: str, channels: Greedy[discord.TextChannel] = None, is_cleaned: bool = False, fuzzy: int = 0
+    ):
         """Add a word to the list of forbidden words
 
         `word`: the word to add to the filter
         `channels`: a list of channels to add this word two
-        `is_cleaned`: an optional True/False argument that will remove punctuation from the word
+        `is_cleaned`: an optional True/False argument that will normalize the message to catch evasions
+        `fuzzy`: an optional number of typos (0 to 2) a word may have and still be caught
         """
-        await self.handle_adding_to_filter(ctx, word, channels, is_cleaned)
+        await self.handle_adding_to_filter(ctx, word, channels, is_cleaned, fuzzy=fuzzy)
 
     @add_word_to_filter.command(name="group")
-    async def _add_to_group(self, ctx, word: str, group_name: str, is_cleaned: bool = False):
+    async def _add_to_group(self, ctx, word: str, group_name: str, is_cleaned: bool = False, fuzzy: int = 0):
         """Add a word to a predefined group of channels
 
         `word`: the word to add to the filter
         `group`: the key name of the group of channels
-        `is_cleaned`: an optional True/False argument that will remove punctuation from the message
+        `is_cleaned`: an optional True/False argument that will normalize the message to catch evasions
+        `fuzzy`: an optional number of typos (0 to 2) a word may have and still be caught
         """
         groups = await self.get_channel_groups(ctx.guild)
         if group_name not in groups:
@@ -154,24 +164,69 @@ class GroupCommands:
             )
         channels = [ctx.guild.get_channel(ch) for ch in groups[group_name]]
         await self.handle_adding_to_filter(
-            ctx, word, channels, is_cleaned
+            ctx, word, channels, is_cleaned, group=group_name, fuzzy=fuzzy
         )
 
-    async def handle_adding_to_filter(self, ctx, word: str, channels: [discord.TextChannel] = None, is_cleaned: bool = False):
+    @add_word_to_filter.command(name="regex")
+    async def _add_regex(self, ctx, pattern: str, channels: Greedy[discord.TextChannel] = None):
+        """Add a regular expression to the list of forbidden words
+
+        `pattern`: the regular expression, wrap it in quotes if it has spaces. Case is ignored.
+        `channels`: a list of channels to add this pattern to
+
+        Backreferences, named groups and nested repetition such as `(a+)+` are refused as they can make matching hang.
+        """
+        current_filtered = await self.wordfilterrule.get_filtered_words(ctx.guild)
+        if any(values['word'] == pattern for values in current_filtered):
+            return await ctx.send(await error_message(f"`{pattern}` is already being filtered."))
+        try:
+            await self.wordfilterrule.add_to_filter(
+                guild=ctx.guild, word=pattern, author=ctx.author, channels=channels, is_regex=True
+            )
+        except ValueError as e:
+            return await ctx.send(await error_message(e.args[0]))
+
+        chans = "\n".join('+ {0}'.format(w) for w in channels) if channels else '+ Global'
+        embed = discord.Embed(
+            title=f"Pattern added",
+            description=f"You can remove this pattern from the filter by running the command: `{ctx.prefix}wordfilterrule remove {pattern}`")
+        embed.add_field(name="Pattern", value=box(pattern))
+        embed.add_field(name="Channels", value=box(chans, "diff"))
+        return await ctx.send(embed=embed)
+
+    async def handle_adding_to_filter(
+        self,
+        ctx,
+        word: str,
+        channels: [discord.TextChannel] = None,
+        is_cleaned: bool = False,
+        group: str = None,
+        fuzzy: int = 0,
+    ):
         word = word.lower()
+        if not 0 <= fuzzy <= MAX_FUZZY_DISTANCE:
+            return await ctx.send(
+                await error_message(f"Fuzzy matching allows between 0 and {MAX_FUZZY_DISTANCE} typos.")
+            )
+        if fuzzy and len(word) < 3 * fuzzy + 1:
+            # short words with typos allowed would match almost anything
+            return await ctx.send(
+                await error_message(f"`{word}` is too short to allow {fuzzy} typo(s), it needs {3 * fuzzy + 1} letters.")
+            )
         current_filtered = await self.wordfilterrule.get_filtered_words(ctx.guild)
         for values in current_filtered:
             if word in values['word']:
                 return await ctx.send(await error_message(f"`{word}` is already being filtered."))
         await self.wordfilterrule.add_to_filter(
-            guild=ctx.guild, word=word, author=ctx.author, channels=channels, is_cleaned=is_cleaned
+            guild=ctx.guild, word=word, author=ctx.author, channels=channels, is_cleaned=is_cleaned, group=group, fuzzy=fuzzy
         )
 
         nl = "\n"
         chans = nl.join('+ {0}'.format(w) for w in channels) if channels else '+ Global'
         fmt_box = box(
             f"Word       :  [{word}]\n"
-            f"Cleaned    :  [{is_cleaned}]\n",
+            f"Cleaned    :  [{is_cleaned}]\n"
+            f"Fuzzy      :  [{fuzzy}]\n",
             "ini"
         )
         embed = discord.Embed(
@@ -232,9 +287,100 @@ class GroupCommands:
 
         1) It checks if a user has spammed more than 10 times in 12 seconds
         2) It checks if the content has been spammed 15 times in 17 seconds.
+        3) It can check if too many near identical messages were sent across all channels in a period.
+
+        The first two limits can be changed for the server or for single channels with `spamrule limit`.
+        The third is off until it is set for the server with `spamrule limit similar`.
         """
         pass
 
+    @spamrule.group(name="limit", aliases=["limits"])
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _spam_limit(self, ctx):
+        """Change how many messages are allowed before it counts as spam"""
+        pass
+
+    @_spam_limit.command(name="user")
+    async def _spam_limit_user(self, ctx, messages: int, seconds: float, channel: discord.TextChannel = None):
+        """Set how many messages one member may send in a period
+
+        Passing a channel only changes the limit in that channel, messages there are counted separately.
+        """
+        await self.handle_spam_limit(ctx, "user", messages, seconds, channel)
+
+    @_spam_limit.command(name="content")
+    async def _spam_limit_content(self, ctx, messages: int, seconds: float, channel: discord.TextChannel = None):
+        """Set how many identical messages may be sent in one channel in a period
+
+        Passing a channel only changes the limit in that channel.
+        """
+        await self.handle_spam_limit(ctx, "content", messages, seconds, channel)
+
+    @_spam_limit.command(name="similar")
+    async def _spam_limit_similar(self, ctx, messages: int, seconds: float):
+        """Set how many near identical messages may be sent across all channels in a period
+
+        Catches raids that change a few characters or rotate between channels. Messages of every member count
+        together, so keep it well above how often members repeat a common message. It is off until set,
+        use 0 messages to turn it off again.
+        """
+        if messages < 0 or not 1 <= seconds <= 300:
+            return await ctx.send(
+                await error_message("Allow 0 or more messages over a period between 1 and 300 seconds.")
+            )
+        await self.spamrule.set_limit(ctx.guild, "similar", messages, seconds)
+        if not messages:
+            return await ctx.send(check_success("Near duplicate detection turned off."))
+        await ctx.send(f"`🚦` Similar limit set to `{messages}` messages every `{seconds}` seconds server wide.")
+
+    @_spam_limit.command(name="reset")
+    async def _spam_limit_reset(self, ctx, channel: discord.TextChannel = None):
+        """Reset the server limits to the defaults, or remove a channel's own limits"""
+        await self.spamrule.reset_limits(ctx.guild, channel)
+        where = f"`{channel}` now uses the server limits" if channel else "Server limits reset to the defaults"
+        await ctx.send(check_success(f"{where}."))
+
+    @_spam_limit.command(name="show")
+    async def _spam_limit_show(self, ctx):
+        """Show the limits in use"""
+        plan = await self.spamrule.get_plan(ctx.guild)
+        user_rate, user_per = plan.options["user_limit"]
+        content_rate, content_per = plan.options["content_limit"]
+        similar_rate, similar_per = plan.options["similar_limit"]
+        lines = [
+            f"[Server]",
+            f"User    : {user_rate} messages / {user_per}s",
+            f"Content : {content_rate} messages / {content_per}s",
+            f"Similar : {similar_rate} messages / {similar_per}s" if similar_rate else "Similar : off",
+        ]
+        for channel_id, limits in plan.options["channel_limits"].items():
+            lines.append(f"\n[#{ctx.guild.get_channel(channel_id)}]")
+            for kind, (rate, per) in limits.items():
+                lines.append(f"{kind.title():<8}: {rate} messages / {per}s")
+        await ctx.send(box("\n".join(lines), "ini"))
+
+    async def handle_spam_limit(self, ctx, kind: str, messages: int, seconds: float, channel=None):
+        if messages < 1 or not 1 <= seconds <= 3600:
+            return await ctx.send(
+                await error_message("Allow at least 1 message over a period between 1 and 3600 seconds.")
+            )
+        await self.spamrule.set_limit(ctx.guild, kind, messages, seconds, channel)
+        where = f"in `{channel}`" if channel else "server wide"
+        await ctx.send(f"`🚦` {kind.title()} limit set to `{messages}` messages every `{seconds}` seconds {where}.")
+
+    @spamrule.command(name="window")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _spam_collect_window(self, ctx, seconds: int):
+        """Set how long spammers are collected for once a raid is detected
+
+        When the window closes the ids of every spammer found are sent to the announcement channel.
+        The default is 300 seconds.
+        """
+        if not 10 <= seconds <= 3600:
+            return await ctx.send(await error_message("The window must be between 10 and 3600 seconds."))
+        await self.spamrule.set_collect_window(ctx.guild, seconds)
+        await ctx.send(f"`⏱` Spammers will be collected for `{seconds}` seconds after a raid starts.")
+
     # commands specific to mention spam rule
     @commands.group()
     @checks.mod_or_permissions(manage_messages=True)
@@ -289,6 +435,8 @@ class GroupCommands:
 
         discord.gg/inviteCode
         discordapp.com/invite/inviteCode
+
+        Allowing one type of link allows the invite in the other type too.
         """
         try:
             await self.inviterule.add_allowed_link(ctx.guild, link)
@@ -411,6 +559,31 @@ def delete_message_wrapper(group, name, friendly_name):
     return delete_message
 
 
+def purge_wrapper(group, name, friendly_name):
+    @group.command(name="purge")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def purge(self, ctx, minutes: int):
+        """
+        Also delete the offender's messages from the last minutes, in every channel
+
+        Only the latest `[p]automodset purge depth` messages of each channel are looked at.
+        `0` turns this off. `manage_messages` perms are needed for this to run.
+        """
+        if not 0 <= minutes <= MAX_PURGE_MINUTES:
+            return await ctx.send(
+                await error_message(f"Minutes must be between 0 and {MAX_PURGE_MINUTES}.")
+            )
+        rule = getattr(self, name)
+        await rule.set_purge_minutes(ctx.guild, minutes)
+        if not minutes:
+            return await ctx.send(check_success("Offenders' recent messages will no longer be purged."))
+        await ctx.send(
+            check_success(f"Offenders' messages from the last {minutes} minutes will be purged.")
+        )
+
+    return purge
+
+
 def whitelist_wrapper(group, name, friendly_name):
     @group.group(name="whitelistrole")
     @checks.mod_or_permissions(manage_messages=True)
@@ -558,6 +731,10 @@ for name, friendly_name in groups.items():
     delete_message.__name__ = f"delete_{name}"
     setattr(GroupCommands, f"delete_{name}", delete_message)
 
+    purge = purge_wrapper(group, name, friendly_name)
+    purge.__name__ = f"purge_{name}"
+    setattr(GroupCommands, f"purge_{name}", purge)
+
     # whitelist settings
     # whitelist commands inherit whitelist role group
     whitelistrole = whitelist_wrapper(group, name, friendly_name)
@@ -0,0 +1,170 @@
+"""
+Append only infraction history in a local SQLite database.
+
+The listener only puts records on an in-memory queue, a background task writes them in batches
+on a dedicated thread. The database runs in WAL mode so queries, on their own thread and
+connection, never wait for a write.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import logging
+import sqlite3
+import time
+
+log = logging.getLogger("red.breadcogs.automod.history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infractions (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    rule TEXT NOT NULL,
+    action TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    strikes REAL NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS infractions_user ON infractions (guild_id, user_id, created_at);
+CREATE INDEX IF NOT EXISTS infractions_rule ON infractions (guild_id, rule, created_at);
+"""
+
+INSERT = """
+INSERT INTO infractions (guild_id, user_id, channel_id, message_id, rule, action, success, deleted, strikes, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class InfractionHistory:
+    # records kept in memory while the writer catches up, past this new records are dropped
+    MAX_QUEUED = 50_000
+    BATCH_SIZE = 500
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._queue = None
+        self._task = None
+        # sqlite connections stay on the thread that opened them
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="automod-history-write")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="automod-history-read")
+        self._write_conn = None
+        self._read_conn = None
+        self.written = 0
+        self.dropped = 0
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path))
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent with NORMAL, a crash can only lose the last batches
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write(self, rows: [tuple]) -> None:
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+            self._write_conn.executescript(SCHEMA)
+        with self._write_conn:
+            self._write_conn.executemany(INSERT, rows)
+
+    def _query(self, sql: str, params: tuple) -> [tuple]:
+        if self._read_conn is None:
+            if self._write_conn is None:
+                # make sure the schema exists before the first read
+                self._writer.submit(self._write, []).result()
+            self._read_conn = self._connect()
+        return self._read_conn.execute(sql, params).fetchall()
+
+    def record(
+        self,
+        guild_id: int,
+        user_id: int,
+        channel_id: int,
+        message_id: int,
+        rule_names: [str],
+        action: str,
+        success: bool,
+        deleted: bool,
+        strikes: float = 0.0,
+    ) -> None:
+        """Queues one row per rule, never blocks"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.MAX_QUEUED)
+            self._task = asyncio.create_task(self._drain())
+
+        now = int(time.time())
+        for rule_name in rule_names:
+            row = (guild_id, user_id, channel_id, message_id, rule_name, action, success, deleted, strikes, now)
+            try:
+                self._queue.put_nowait(row)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = [await self._queue.get()]
+            while len(rows) < self.BATCH_SIZE and not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                await loop.run_in_executor(self._writer, self._write, rows)
+                self.written += len(rows)
+            except sqlite3.Error:
+                self.dropped += len(rows)
+                log.exception(f"Failed to write {len(rows)} infractions")
+
+    async def query(self, sql: str, params: tuple = ()) -> [tuple]:
+        return await asyncio.get_running_loop().run_in_executor(self._reader, self._query, sql, params)
+
+    async def user_history(self, guild_id: int, user_id: int, limit: int = 10) -> [tuple]:
+        """Latest infractions of a user as (created_at, rule, action, success, deleted, channel_id)"""
+        return await self.query(
+            "SELECT created_at, rule, action, success, deleted, channel_id FROM infractions "
+            "WHERE guild_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (guild_id, user_id, limit),
+        )
+
+    async def user_count(self, guild_id: int, user_id: int) -> int:
+        rows = await self.query(
+            "SELECT COUNT(*) FROM infractions WHERE guild_id = ? AND user_id = ?", (guild_id, user_id),
+        )
+        return rows[0][0]
+
+    async def rule_counts(self, guild_id: int, rule_names: [str], since: int) -> {str: int}:
+        """Hits per rule since a unix timestamp, every count is a range scan of the rule index"""
+        counts = {}
+        for rule_name in rule_names:
+            rows = await self.query(
+                "SELECT COUNT(*) FROM infractions WHERE guild_id = ? AND rule = ? AND created_at >= ?",
+                (guild_id, rule_name, since),
+            )
+            counts[rule_name] = rows[0][0]
+        return counts
+
+    async def close(self) -> None:
+        """Writes what is still queued and closes the database"""
+        if self._task is not None:
+            self._task.cancel()
+        loop = asyncio.get_running_loop()
+        if self._queue is not None and not self._queue.empty():
+            rows = []
+            while not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            await loop.run_in_executor(self._writer, self._write, rows)
+            self.written += len(rows)
+
+        for executor, attr in ((self._writer, "_write_conn"), (self._reader, "_read_conn")):
+            conn = getattr(self, attr)
+            if conn is not None:
+                await loop.run_in_executor(executor, conn.close)
+                setattr(self, attr, None)
+            executor.shutdown(wait=False)
@@ -0,0 +1,74 @@
+"""
+Per member state the message listener needs before running any rule.
+
+Whether a member is immune to automod and which rules their roles whitelist them from is
+looked up once and kept until their roles change, the guild's roles change or `TTL` passes.
+The TTL bounds staleness for changes no event tells us about, like Red's immunity list.
+"""
+from collections import defaultdict
+import time
+
+import discord
+
+from .plan import GuildRulePlan
+from .ratelimit import ExpiringStore
+
+
+class MemberState:
+    __slots__ = ("immune", "role_ids", "generation", "version", "whitelisted")
+
+    def __init__(self, immune: bool, role_ids: frozenset, generation: int):
+        self.immune = immune
+        self.role_ids = role_ids
+        self.generation = generation
+        # rules whose whitelist covers the member, for the plan with `version`
+        self.version = None
+        self.whitelisted = frozenset()
+
+
+class MemberCache:
+    TTL = 120
+    MAX_SIZE = 100_000
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.store = ExpiringStore(ttl=self.TTL, max_size=self.MAX_SIZE)
+        self._generations = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {**self.store.stats(), "hits": self.hits, "misses": self.misses}
+
+    async def get(self, member: discord.Member, plan: GuildRulePlan) -> MemberState:
+        key = (member.guild.id, member.id)
+        now = time.monotonic()
+        generation = self._generations[member.guild.id]
+        state = self.store.get(key, now)
+        if state is None or state.generation != generation:
+            self.misses += 1
+            state = MemberState(
+                immune=await self.bot.is_automod_immune(member),
+                role_ids=frozenset(role.id for role in member.roles),
+                generation=generation,
+            )
+            self.store.set(key, state, now)
+        else:
+            self.hits += 1
+
+        if state.version != plan.version:
+            # whitelist setters build a new plan, so a version change is all it takes to notice
+            state.whitelisted = frozenset(
+                rule_name
+                for rule_name, rule_plan in plan.rules.items()
+                if rule_plan.role_is_whitelisted(state.role_ids)
+            )
+            state.version = plan.version
+        return state
+
+    def invalidate(self, guild_id: int, member_id: int) -> None:
+        self.store.pop((guild_id, member_id))
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """Forgets every member of guild, entries are dropped lazily on their next lookup"""
+        self._generations[guild_id] += 1
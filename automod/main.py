@@ -1,9 +1,14 @@
+from functools import partial
+import asyncio
+import time
+
 import discord
 import logging
 
 from redbot.core.commands import Cog
 from redbot.core import Config
-from redbot.core.data_manager import bundled_data_path
+from redbot.core.data_manager import bundled_data_path, cog_data_path
+from redbot.core.utils.chat_formatting import box
 
 from .rules.wordfilter import WordFilterRule
 from .rules.wallspam import WallSpamRule
@@ -17,10 +22,28 @@ from .constants import *
 from .groupcommands import GroupCommands
 
 from .settings import Settings
+from .plan import RulePlanStore, GuildRulePlan
+from .analysis import MessageAnalysis
+from .raid import RaidDetector, AGE_LABELS
+from .actions import ActionPlan
+from .deletes import DeleteBatcher
+from .executor import ActionExecutor, LANE_ANNOUNCE
+from .announcements import Announcement, AnnouncementDigest
+from .immunity import MemberCache
+from .scheduling import RuleScheduler, TERMINAL_ACTION
+from .permissions import PermissionCache
+from .strikes import StrikeBook
+from .history import InfractionHistory
+from .recent import RecentMessages, partial_message
+from .memo import VerdictMemo
+from .patterns import PatternTimeout
 from .utils import maybe_add_role
 
 log = logging.getLogger(name="red.breadcogs.automod")
 
+# seconds a message has to stay unchanged before its edit is checked
+EDIT_DEBOUNCE = 1.0
+
 
 class AutoMod(
     Cog, Settings, GroupCommands,
@@ -44,15 +67,16 @@ class AutoMod(
 
         self.config.register_guild(**self.guild_defaults)
         self.data_path = bundled_data_path(self)
+        self.plans = RulePlanStore(self.config, size_hint=lambda: len(self.bot.guilds))
 
         # rules
-        self.wallspamrule = WallSpamRule(self.config)
-        self.mentionspamrule = MentionSpamRule(self.config)
-        self.inviterule = DiscordInviteRule(self.config)
-        self.spamrule = SpamRule(self.config, self.bot, self.data_path)
-        self.maxwordsrule = MaxWordsRule(self.config)
-        self.maxcharsrule = MaxCharsRule(self.config)
-        self.wordfilterrule = WordFilterRule(self.config)
+        self.wallspamrule = WallSpamRule(self.config, self.plans)
+        self.mentionspamrule = MentionSpamRule(self.config, self.plans)
+        self.inviterule = DiscordInviteRule(self.config, self.plans)
+        self.spamrule = SpamRule(self.config, self.plans, self.bot, self.data_path)
+        self.maxwordsrule = MaxWordsRule(self.config, self.plans)
+        self.maxcharsrule = MaxCharsRule(self.config, self.plans)
+        self.wordfilterrule = WordFilterRule(self.config, self.plans)
 
         self.rules_map = {
             "wallspamrule": self.wallspamrule,
@@ -63,60 +87,166 @@ class AutoMod(
             "maxcharsrule": self.maxcharsrule,
             "wordfilterrule": self.wordfilterrule,
         }
+        self.members = MemberCache(self.bot)
+        self.scheduler = RuleScheduler(self.rules_map.values())
+        self.verdicts = VerdictMemo(self.rules_map.values())
+        self.permissions = PermissionCache()
+        self.strikes = StrikeBook(self.config)
+        self.history = InfractionHistory(cog_data_path(self) / "history.sqlite3")
+        self.recent = RecentMessages()
+        # message id -> pending check of its latest edit
+        self._edits = {}
+
+        self.raids = RaidDetector(self.plans, self._announce_raid)
+        self.deletes = DeleteBatcher()
+        self.executor = ActionExecutor()
+        self.announcements = AnnouncementDigest(
+            lambda guild_id, job: self.executor.submit(guild_id, LANE_ANNOUNCE, job)
+        )
+
+    def cog_unload(self):
+        self.spamrule.cancel_collectors()
+        self.raids.cancel()
+        self.deletes.cancel()
+        self.executor.cancel()
+        self.strikes.cancel()
+        asyncio.create_task(self.history.close())
+        self.announcements.cancel()
+        for task in self._edits.values():
+            task.cancel()
+        self._edits.clear()
+
+    async def _announce_raid(self, guild_id: int, is_raid: bool, histogram: [int]):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        self.bot.dispatch("automod_raid", guild, is_raid)
+
+        plan = await self.plans.get(guild)
+        if not plan.is_announcement_enabled or plan.announcement_channel is None:
+            return
+
+        if is_raid:
+            embed = discord.Embed(
+                title="🚨 Join raid detected",
+                description="Stricter rules are in effect and offending messages are deleted.",
+                color=discord.Color.red(),
+            )
+        else:
+            embed = discord.Embed(title="Raid state ended", color=discord.Color.green())
+        ages = "\n".join(f"{label:<6}: {count}" for label, count in zip(AGE_LABELS, histogram))
+        embed.add_field(name="Recent joins by account age", value=box(ages, "ini"))
+        await self.announcements.send(guild, plan.announcement_channel, embed)
+
+    @Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self.members.invalidate(after.guild.id, after.id)
+            if after.id == self.bot.user.id:
+                self.permissions.invalidate(after.guild.id)
+
+    @Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.members.invalidate(member.guild.id, member.id)
+
+    @Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        # admin and mod roles are immune, a permission change can make or unmake one
+        self.members.invalidate_guild(after.guild.id)
+        self.permissions.invalidate(after.guild.id)
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.members.invalidate_guild(role.guild.id)
+        self.permissions.invalidate(role.guild.id)
+
+    @Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        # a new role shifts the position of the roles above it
+        self.permissions.invalidate(role.guild.id)
+
+    @Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        if before.owner_id != after.owner_id:
+            self.permissions.invalidate(after.id)
+
+    @Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        self.permissions.invalidate_channel(after)
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.announcements.forget_channel(channel.id)
+        self.permissions.invalidate_channel(channel)
+        self.recent.forget_channel(channel)
+
+    @Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if member.bot:
+            return
+        await self.raids.on_join(member)
 
     async def _take_action(
-        self, rule, message: discord.Message,
+        self, actions: ActionPlan, message: discord.Message, plan: GuildRulePlan, analysis: MessageAnalysis,
     ):
         guild: discord.Guild = message.guild
         author: discord.Member = message.author
         channel: discord.TextChannel = message.channel
 
-        action_to_take = await rule.get_action_to_take(guild)
-        self.bot.dispatch(
-            f"automod_{rule.rule_name}", author, message,
-        )
-        log.info(
-            f"{rule.rule_name} - {author} ({author.id}) - {guild} ({guild.id}) - {channel} ({channel.id})"
-        )
+        action_to_take = actions.action_to_take
+        rule_names = ", ".join(actions.rule_names)
+        for rule in actions.rules:
+            self.bot.dispatch(
+                f"automod_{rule.rule_name}", author, message,
+            )
+        log.info(f"{rule_names} - {author} ({author.id}) - {guild} ({guild.id}) - {channel} ({channel.id})")
 
-        _action_reason = f"[AutoMod] {rule.rule_name}"
+        _action_reason = f"[AutoMod] {rule_names}"
 
-        (should_announce, announce_channel,) = await self.announcements_enabled(guild=guild)
-        should_delete = await rule.get_should_delete(guild)
+        should_announce = plan.is_announcement_enabled
+        announce_channel = plan.announcement_channel
+        should_delete = actions.delete_message
 
-        message_has_been_deleted = False
+        # requests that are bound to fail are not sent, `automodset show` lists what is missing
+        permissions = self.permissions.get(guild)
+        deletion = None
         if should_delete:
-            try:
-                await message.delete()
-                message_has_been_deleted = True
-            except discord.errors.Forbidden:
-                log.warning(f"[AutoMod] {rule.rule_name} - Missing permissions to delete message")
-            except discord.errors.NotFound:
-                message_has_been_deleted = True
-                log.warning(
-                    f"[AutoMod] {rule.rule_name} - Could not delete message as it does not exist"
-                )
+            if permissions.can_delete(channel):
+                # batched with other deletes in the channel, the announcement waits for it instead of this job
+                deletion = self.deletes.queue(message)
+            else:
+                self.permissions.skipped += 1
+                log.debug(f"[AutoMod] {rule_names} - Missing permissions to delete message")
+
         action_taken_success = True
-        if action_to_take == "kick":
+        if action_to_take in ("kick", "ban") and not permissions.can_punish(action_to_take, author):
+            self.permissions.skipped += 1
+            log.debug(f"{rule_names} - Cannot {action_to_take} {author} ({author.id}), missing permissions")
+            action_taken_success = False
+
+        elif action_to_take == "kick":
             try:
                 await author.kick(reason=_action_reason)
-                log.info(f"{rule.rule_name} - Kicked {author} ({author.id})")
+                log.info(f"{rule_names} - Kicked {author} ({author.id})")
             except discord.errors.Forbidden:
-                log.warning(f"{rule.rule_name} - Failed to kick user, missing permissions")
+                log.warning(f"{rule_names} - Failed to kick user, missing permissions")
+                self.permissions.invalidate(guild.id)
                 action_taken_success = False
 
         elif action_to_take == "add_role":
-            try:
-                role = guild.get_role(
-                    await self.config.guild(guild).get_raw(rule.rule_name, "role_to_add",)
-                )
+            role = guild.get_role(actions.role_to_add) if actions.role_to_add else None
+            if role is not None and not permissions.can_add_role(role):
+                self.permissions.skipped += 1
+                log.debug(f"{rule_names} - Cannot add {role} to {author} ({author.id}), missing permissions")
+                action_taken_success = False
+            elif role is not None:
                 await maybe_add_role(
                     author, role,
                 )
-                log.info(f"{rule.rule_name} - Added Role (role) to {author} ({author.id})")
-            except KeyError:
+                log.info(f"{rule_names} - Added Role (role) to {author} ({author.id})")
+            else:
                 # role to add not set
-                log.info(f"{rule.rule_name} No role set to add to offending user")
+                log.info(f"{rule_names} No role set to add to offending user")
                 action_taken_success = False
 
         elif action_to_take == "ban":
@@ -124,57 +254,220 @@ class AutoMod(
                 await guild.ban(
                     user=author, reason=_action_reason, delete_message_days=1,
                 )
-                log.info(f"{rule.rule_name} - Banned {author} ({author.id})")
+                log.info(f"{rule_names} - Banned {author} ({author.id})")
             except discord.errors.Forbidden:
-                log.warning(f"{rule.rule_name} - Failed to ban user, missing permissions")
+                log.warning(f"{rule_names} - Failed to ban user, missing permissions")
+                self.permissions.invalidate(guild.id)
                 action_taken_success = False
             except discord.errors.HTTPException:
-                log.warning(f"{rule.rule_name} - Failed to ban user [HTTP EXCEPTION]")
+                log.warning(f"{rule_names} - Failed to ban user [HTTP EXCEPTION]")
                 action_taken_success = False
 
-        if should_announce:
-            if announce_channel is not None:
-                announce_embed = await rule.get_announcement_embed(
-                    message, message_has_been_deleted, action_taken_success, action_to_take,
+        # a ban already removes the last day of messages
+        if actions.purge_minutes and not (action_to_take == "ban" and action_taken_success):
+            self._purge(guild, author, actions.purge_minutes, permissions, message.id)
+
+        def finish(message_has_been_deleted: bool):
+            self.history.record(
+                guild.id,
+                author.id,
+                channel.id,
+                message.id,
+                actions.rule_names,
+                action_to_take,
+                action_taken_success,
+                message_has_been_deleted,
+                actions.strikes,
+            )
+            if should_announce and announce_channel is not None:
+                announce = partial(
+                    self._announce,
+                    actions,
+                    message,
+                    analysis,
+                    announce_channel,
+                    plan.digest_window,
+                    action_taken_success,
+                    message_has_been_deleted,
                 )
-                announce_channel_obj = guild.get_channel(announce_channel)
-                await announce_channel_obj.send(embed=announce_embed)
+                # announcements wait behind every pending moderation action of the guild
+                self.executor.submit(guild.id, LANE_ANNOUNCE, announce)
+
+        if deletion is None:
+            finish(False)
+        else:
+            deletion.add_done_callback(lambda done: finish(self._deleted(rule_names, done)))
+
+    def _purge(self, guild: discord.Guild, author: discord.Member, minutes: int, permissions, message_id: int):
+        """Queues deletion of the author's recent messages in every channel, no history is fetched"""
+        for channel_id, message_ids in self.recent.pop_author(guild.id, author.id, minutes).items():
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                continue
+            if not permissions.can_delete(channel):
+                self.permissions.skipped += 1
+                continue
+            for recent_id in message_ids:
+                # the offending message itself is taken care of already
+                if recent_id != message_id:
+                    self.deletes.queue(partial_message(channel, recent_id)).add_done_callback(self._purged)
+
+    @staticmethod
+    def _purged(deletion) -> None:
+        # messages deleted meanwhile are expected, the rest is only worth a debug line
+        if not deletion.cancelled() and deletion.exception() is not None:
+            log.debug(f"[AutoMod] Failed to purge message: {deletion.exception()!r}")
+
+    def _deleted(self, rule_names: str, deletion) -> bool:
+        """Whether the queued deletion of a message went through"""
+        if deletion.cancelled():
+            return False
+        error = deletion.exception()
+        if isinstance(error, discord.errors.Forbidden):
+            log.warning(f"[AutoMod] {rule_names} - Missing permissions to delete message")
+            return False
+        if isinstance(error, discord.errors.NotFound):
+            log.warning(f"[AutoMod] {rule_names} - Could not delete message as it does not exist")
+            return True
+        if error is not None:
+            log.warning(f"[AutoMod] {rule_names} - Failed to delete message: {error}")
+            return False
+        return True
+
+    async def _announce(
+        self,
+        actions: ActionPlan,
+        message: discord.Message,
+        analysis: MessageAnalysis,
+        announce_channel: int,
+        digest_window: float,
+        action_taken_success: bool,
+        message_has_been_deleted: bool,
+    ):
+        announce_embed = await actions.rules[0].get_announcement_embed(
+            message,
+            message_has_been_deleted,
+            action_taken_success,
+            actions.action_to_take,
+            analysis=analysis,
+            rule_names=actions.rule_names,
+        )
+        if actions.strikes:
+            announce_embed.add_field(name="Strikes", value=f"`{actions.strikes:.1f}`")
+        announcement = Announcement(
+            embed=announce_embed,
+            author=message.author,
+            rule_names=actions.rule_names,
+            action_taken=actions.action_to_take,
+            action_taken_success=action_taken_success,
+            deleted=message_has_been_deleted,
+            channel_id=message.channel.id,
+        )
+        await self.announcements.add(message.guild, announce_channel, digest_window, announcement)
 
     @Cog.listener()
     async def on_message_edit(
         self, before: discord.Message, after: discord.Message,
     ):
-        await self._listen_for_infractions(after)
+        # embeds unfurling and pins are edits too, only new content needs another look
+        if before.content == after.content:
+            return
+
+        # an edit storm only gets the last version checked
+        pending = self._edits.pop(after.id, None)
+        if pending is not None:
+            pending.cancel()
+        self._edits[after.id] = asyncio.create_task(self._check_edit(after))
+
+    async def _check_edit(self, message: discord.Message):
+        await asyncio.sleep(EDIT_DEBOUNCE)
+        del self._edits[message.id]
+        await self._listen_for_infractions(message, is_edit=True)
+
+    async def _run_rule(self, rule, message: discord.Message, rule_plan, analysis: MessageAnalysis):
+        started = time.perf_counter()
+        is_offensive = await rule.is_offensive(message, rule_plan, analysis)
+        self.scheduler.record(rule.rule_name, time.perf_counter() - started)
+        return is_offensive
 
     @Cog.listener(name="on_message_without_command")
     async def _listen_for_infractions(
-        self, message: discord.Message,
+        self, message: discord.Message, is_edit: bool = False,
     ):
         guild = message.guild
         author = message.author
 
-        if not message.guild or await self.bot.is_automod_immune(author):
+        # don't listen to other bots, no skynet here
+        if not message.guild or message.author.bot:
             return
 
-        # # immune from automod actions
-        # if isinstance(author, discord.Member):
-        #     if await self.bot.is_automod_immune(message.author):
-        #         return
-
-        # don't listen to other bots, no skynet here
-        if message.author.bot:
+        plan = await self.plans.get(guild)
+        member = await self.members.get(author, plan)
+        # immune from automod actions
+        if member.immune:
             return
 
-        for (rule_name, rule,) in self.rules_map.items():
-            if await rule.is_enabled(guild):
+        # edits keep their place in the channel
+        if not is_edit:
+            if plan.is_purging:
+                self.recent.add(message, plan.recent_depth)
+            else:
+                self.recent.forget_guild(guild.id)
+
+        analysis = MessageAnalysis(message)
+        hits = []
+        # verdicts of memoized rules for this content, looked up when the first such rule runs
+        verdicts = None
+        # set once a ban is certain, the remaining rules only run to count the message or add to the purge
+        settled = False
+
+        for rule in self.scheduler.order(plan):
+            if is_edit and not rule.is_content_rule:
+                continue
+            rule_plan = plan.get_rule(rule.rule_name)
+            if settled and not rule.is_stateful and not rule_plan.purge_minutes:
+                continue
+            if rule_plan.is_enabled:
                 # check all if roles - if any are immune, then that's okay, we'll let them spam :)
-                is_whitelisted_role = await rule.role_is_whitelisted(guild, author.roles,)
-                is_channel_or_global = await rule.is_enforced_channel(guild, message.channel,)
+                is_whitelisted_role = rule.rule_name in member.whitelisted
+                is_channel_or_global = rule_plan.is_enforced_channel(message.channel.id)
                 if is_whitelisted_role or not is_channel_or_global:
-                    # user is whitelisted, channel is not whitelisted let's stop here
-                    return
+                    # user is whitelisted, channel is not enforced, skip to the next rule
+                    continue
+
+                if rule.is_memoized:
+                    if verdicts is None:
+                        verdicts = self.verdicts.get(plan, message)
+                    is_offensive = verdicts.get(rule.rule_name)
+                    if is_offensive is not None:
+                        self.verdicts.hits[rule.rule_name] += 1
+                    else:
+                        self.verdicts.misses[rule.rule_name] += 1
+                        try:
+                            is_offensive = bool(await self._run_rule(rule, message, rule_plan, analysis))
+                        except PatternTimeout:
+                            # the content wasn't fully checked, the next copy of it gets another try
+                            is_offensive = False
+                        else:
+                            verdicts[rule.rule_name] = is_offensive
+                else:
+                    is_offensive = await self._run_rule(rule, message, rule_plan, analysis)
+                if is_offensive:
+                    hits.append((rule, rule_plan))
+                    if rule_plan.action_to_take == TERMINAL_ACTION and (
+                        rule_plan.delete_message or self.permissions.get(guild).can_punish(TERMINAL_ACTION, author)
+                    ):
+                        # nothing the remaining rules find can change the action or the delete,
+                        # unless the ban can't happen and another rule would still delete it
+                        settled = True
 
-                if await rule.is_offensive(message):
-                    await self._take_action(
-                        rule, message,
-                    )
+        if hits:
+            # one delete, one action and one announcement however many rules were broken
+            actions = ActionPlan.from_hits(hits)
+            if plan.strike_settings["enabled"]:
+                await self.strikes.load(guild)
+                score = self.strikes.add(guild.id, author.id, plan.strike_settings["half_life"])
+                actions = self.strikes.escalate(actions, score, plan.strike_settings)
+            self.executor.submit(
+                guild.id, actions.lane, partial(self._take_action, actions, message, plan, analysis),
+            )
@@ -0,0 +1,187 @@
+from collections import deque
+from typing import Iterable, Optional, Tuple
+
+
+class AhoCorasick:
+    """
+    Multi pattern substring matcher.
+
+    The automaton is built once from every pattern, searching a text is a single pass
+    over it regardless of how many patterns there are. For a handful of patterns plain
+    substring checks are faster than walking the automaton in python, so those skip it.
+    """
+
+    __slots__ = ("_goto", "_fail", "_output", "_size", "_patterns")
+
+    SMALL = 32
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto = [{}]
+        self._output = [None]
+        self._size = 0
+        for pattern in patterns:
+            self._add(pattern)
+        self._fail = self._link()
+        self._patterns = None
+        if self._size <= self.SMALL:
+            self._patterns = tuple(dict.fromkeys(p for p in self._output if p is not None))
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def _add(self, pattern: str) -> None:
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._output.append(None)
+            state = next_state
+        if self._output[state] is None:
+            self._size += 1
+        self._output[state] = pattern
+
+    def _link(self) -> [int]:
+        """Breadth first pass computing failure links, outputs are merged along them"""
+        fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = self._goto[fallback].get(char, 0)
+                if self._output[next_state] is None:
+                    # a shorter pattern ending here still counts as a match
+                    self._output[next_state] = self._output[fail[next_state]]
+        return fail
+
+    def search(self, text: str) -> Optional[str]:
+        """Returns the first pattern found in text, or None"""
+        if self._patterns is not None:
+            for pattern in self._patterns:
+                if pattern in text:
+                    return pattern
+            return None
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (levenshtein with adjacent swaps) between a and b.
+
+    Gives up as soon as the distance is known to be over limit and returns limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, row = previous, row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+    return row[-1]
+
+
+def deletes(word: str, distance: int) -> {str}:
+    """Every string obtained by removing up to `distance` characters from word, word included"""
+    found = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {w[:i] + w[i + 1 :] for w in edge for i in range(len(w))} - found
+        found |= edge
+    return found
+
+
+class FuzzyIndex:
+    """
+    Symmetric delete index for approximate word lookups.
+
+    Every word is stored under all the strings reachable by deleting up to its allowed
+    distance worth of characters. A lookup only generates the deletes of the token being
+    checked, so its cost depends on the token's length and not on how many words are indexed.
+    """
+
+    __slots__ = ("_deletes", "_distances", "max_distance")
+
+    # longer tokens are walls of text, not typos of a filtered word
+    MAX_TOKEN_LENGTH = 32
+
+    def __init__(self, words: Iterable[Tuple[str, int]]):
+        self._deletes = {}
+        self._distances = {}
+        self.max_distance = 0
+        for word, distance in words:
+            if not word or distance <= 0:
+                continue
+            self._distances[word] = max(distance, self._distances.get(word, 0))
+            self.max_distance = max(self.max_distance, distance)
+            for deleted in deletes(word, distance):
+                candidates = self._deletes.get(deleted)
+                if candidates is None:
+                    self._deletes[deleted] = word
+                elif isinstance(candidates, str):
+                    if candidates != word:
+                        self._deletes[deleted] = (candidates, word)
+                elif word not in candidates:
+                    self._deletes[deleted] = candidates + (word,)
+
+    def __len__(self):
+        return len(self._distances)
+
+    def __bool__(self):
+        return bool(self._distances)
+
+    def lookup(self, token: str) -> Optional[str]:
+        """Returns an indexed word within its allowed distance of token, or None"""
+        if len(token) > self.MAX_TOKEN_LENGTH:
+            return None
+
+        checked = set()
+        for deleted in deletes(token, self.max_distance):
+            candidates = self._deletes.get(deleted)
+            if candidates is None:
+                continue
+            if isinstance(candidates, str):
+                candidates = (candidates,)
+            for word in candidates:
+                if word in checked:
+                    continue
+                checked.add(word)
+                limit = self._distances[word]
+                if edit_distance(token, word, limit) <= limit:
+                    return word
+        return None
+
+    def search(self, tokens: Iterable[str]) -> Optional[str]:
+        for token in tokens:
+            found = self.lookup(token)
+            if found is not None:
+                return found
+        return None
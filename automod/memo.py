@@ -0,0 +1,58 @@
+"""
+Remembers the verdicts of rules that only look at a message's content.
+
+Copypasta during a raid is the same content thousands of times, rules with `is_memoized` are
+run on it once per plan version and channel scope, every copy after that is a hash and a lookup.
+Rules keeping state between messages, like spam rate limits, never go through here, and neither
+does a verdict a regex filter ran out of time on.
+"""
+from collections import OrderedDict, defaultdict
+import hashlib
+
+import discord
+
+from .plan import GuildRulePlan
+
+
+class VerdictMemo:
+    MAX_SIZE = 10_000
+
+    def __init__(self, rules, max_size: int = MAX_SIZE):
+        self.rules = [rule for rule in rules if rule.is_memoized]
+        self.max_size = max_size
+        # (plan version, channel scope, content digest) -> {rule name: verdict}
+        self._verdicts = OrderedDict()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._verdicts),
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+            "rules": {
+                rule.rule_name: (self.hits[rule.rule_name], self.misses[rule.rule_name]) for rule in self.rules
+            },
+        }
+
+    def scope(self, plan: GuildRulePlan, channel_id: int) -> int:
+        """The channel when one of the rules judges it differently from the rest of the guild"""
+        for rule in self.rules:
+            if rule.is_channel_scoped(plan.get_rule(rule.rule_name), channel_id):
+                return channel_id
+        return 0
+
+    def get(self, plan: GuildRulePlan, message: discord.Message) -> dict:
+        """Verdicts known for the message's content, rules fill in what is missing"""
+        digest = hashlib.blake2b(message.content.encode(), digest_size=16).digest()
+        key = (plan.version, self.scope(plan, message.channel.id), digest)
+        verdicts = self._verdicts.get(key)
+        if verdicts is None:
+            verdicts = self._verdicts[key] = {}
+            while len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._verdicts.move_to_end(key)
+        return verdicts
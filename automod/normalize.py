@@ -0,0 +1,75 @@
+"""
+Text normalization used to catch filter evasion.
+
+Every table is built once on import, normalizing a message is a couple of `str.translate`
+passes and one regex substitution.
+"""
+import re
+import unicodedata
+
+ZERO_WIDTH = (
+    "\u00ad"  # soft hyphen
+    "\u034f"  # combining grapheme joiner
+    "\u061c"  # arabic letter mark
+    "\u180e"  # mongolian vowel separator
+    "\u200b\u200c\u200d\u200e\u200f"  # zero width space, joiners and direction marks
+    "\u202a\u202b\u202c\u202d\u202e"  # bidi embedding and overrides
+    "\u2060\u2061\u2062\u2063\u2064"  # word joiner and invisible operators
+    "\ufeff"  # zero width no-break space
+)
+
+# letters from other scripts that render like latin ones, NFKD already handles fullwidth
+# and mathematical alphanumerics so only true lookalikes are listed here
+CONFUSABLES = {
+    # cyrillic
+    "а": "a", "в": "b", "с": "c", "е": "e", "ё": "e", "һ": "h", "і": "i", "ї": "i", "ј": "j",
+    "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "ѕ": "s", "т": "t", "у": "y", "х": "x",
+    "ԁ": "d", "ԛ": "q", "ԝ": "w", "ɡ": "g",
+    # greek
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p",
+    "τ": "t", "υ": "u", "χ": "x", "ω": "w", "ϲ": "c",
+    # latin lookalikes
+    "ı": "i", "ł": "l", "ø": "o", "đ": "d", "ħ": "h", "ŀ": "l", "ß": "ss", "æ": "ae", "œ": "oe",
+}
+
+LEET = {
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g",
+    "@": "a", "$": "s", "!": "i", "|": "l", "+": "t", "€": "e", "£": "l",
+}
+
+
+def _build_tables() -> (dict, dict):
+    fold = {ord(char): None for char in ZERO_WIDTH}
+    evasion = {}
+    # the basic multilingual plane covers every punctuation and mark worth caring about
+    for codepoint in range(0x10000):
+        category = unicodedata.category(chr(codepoint))
+        if category == "Mn":
+            # combining marks left behind by NFKD, `fïltér` -> `filter`
+            fold[codepoint] = None
+        elif category[0] == "P":
+            evasion[codepoint] = None
+    for char, replacement in CONFUSABLES.items():
+        fold[ord(char)] = replacement
+    for char, replacement in LEET.items():
+        evasion[ord(char)] = replacement
+    return fold, evasion
+
+
+FOLD_TABLE, EVASION_TABLE = _build_tables()
+REPEATED_RE = re.compile(r"(.)\1+")
+
+
+def fold(text: str) -> str:
+    """Removes invisible characters and accents and maps lookalike letters to latin, case is kept"""
+    return unicodedata.normalize("NFKD", text).translate(FOLD_TABLE)
+
+
+def normalize(text: str) -> str:
+    """
+    Full evasion normalization, `F.ＩＬ7Ë..rrred` becomes `filtered`.
+
+    Both the filtered words and the messages go through this so they stay comparable.
+    """
+    text = fold(text.casefold()).translate(EVASION_TABLE)
+    return REPEATED_RE.sub(r"\1", text)
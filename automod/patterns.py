@@ -0,0 +1,132 @@
+"""
+User supplied regex filters.
+
+Patterns are validated when added and every pattern of a scope is compiled into one
+alternation. Matching runs on a worker thread with a hard time budget, counted from when the
+search is queued, so a pattern that backtracks badly can never stall the event loop.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Optional
+
+import regex
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+log = logging.getLogger("red.breadcogs.automod.patterns")
+
+MAX_PATTERN_LENGTH = 200
+# seconds a single message may spend in the combined pattern
+TIME_BUDGET = 0.05
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="automod-regex")
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    _REPEATS += (sre_parse.POSSESSIVE_REPEAT,)
+_UNBOUNDED = sre_parse.MAXREPEAT
+
+
+class RiskyPatternError(ValueError):
+    pass
+
+
+class PatternTimeout(Exception):
+    """The time budget ran out before the search finished, the text may or may not match"""
+
+
+def _children(op, av) -> Iterable:
+    """Yields the sub patterns of a parsed node"""
+    if op in _REPEATS:
+        yield av[2]
+    elif op == sre_parse.SUBPATTERN:
+        yield av[-1]
+    elif op == sre_parse.BRANCH:
+        yield from av[1]
+    elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        yield av[1]
+    elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+        yield av
+    elif op == sre_parse.GROUPREF_EXISTS:
+        yield from (sub for sub in av[1:] if sub is not None)
+
+
+def _check(parsed, inside_repeat: bool) -> None:
+    for op, av in parsed:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            raise RiskyPatternError("Backreferences are not allowed.")
+
+        is_repeat = op in _REPEATS and av[1] > 1
+        if is_repeat and inside_repeat:
+            raise RiskyPatternError("Nested repetition like `(a+)+` is not allowed.")
+        if op == sre_parse.BRANCH and inside_repeat:
+            raise RiskyPatternError("Alternation inside a repetition like `(a|aa)+` is not allowed.")
+
+        for child in _children(op, av):
+            _check(child, inside_repeat or is_repeat)
+
+
+def validate_pattern(pattern: str) -> None:
+    """
+    Rejects patterns that are invalid or prone to catastrophic backtracking
+
+    Raises
+    -------
+        RiskyPatternError with a message that can be shown to the user
+    """
+    if not pattern:
+        raise RiskyPatternError("The pattern is empty.")
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise RiskyPatternError(f"Patterns are limited to {MAX_PATTERN_LENGTH} characters.")
+
+    try:
+        parsed = sre_parse.parse(pattern)
+        # it has to survive being one branch of the combined pattern
+        regex.compile(f"(?:{pattern})|(?:x)")
+    except (sre_parse.error, regex.error, RecursionError) as e:
+        raise RiskyPatternError(f"The pattern is not valid: {e}")
+
+    if parsed.state.groupdict:
+        raise RiskyPatternError("Named groups are not allowed.")
+    _check(parsed, inside_repeat=False)
+
+
+class CombinedPattern:
+    """All regex filters of one scope compiled into a single alternation"""
+
+    __slots__ = ("pattern",)
+
+    def __init__(self, patterns: Iterable[str]):
+        patterns = list(dict.fromkeys(patterns))
+        self.pattern = None
+        if patterns:
+            self.pattern = regex.compile(
+                "|".join(f"(?:{p})" for p in patterns), regex.IGNORECASE
+            )
+
+    def __bool__(self):
+        return self.pattern is not None
+
+    async def search(self, text: str) -> Optional[str]:
+        """
+        Returns the matched text, or None when nothing matched
+
+        Raises
+        -------
+            PatternTimeout when the search did not finish within the time budget, including the
+            time it waited for a free worker thread
+        """
+        loop = asyncio.get_running_loop()
+        search = partial(self.pattern.search, text, timeout=TIME_BUDGET, concurrent=True)
+        try:
+            # a search still queued when the budget runs out is cancelled before it starts
+            match = await asyncio.wait_for(loop.run_in_executor(_executor, search), TIME_BUDGET)
+        except (TimeoutError, asyncio.TimeoutError):
+            log.warning(f"Regex filter gave up after {TIME_BUDGET}s on a {len(text)} character message")
+            raise PatternTimeout
+        return match.group(0) if match else None
@@ -0,0 +1,105 @@
+"""
+Snapshot of what the bot is allowed to do in each guild.
+
+Actions check the snapshot before calling the API, so a guild missing permissions costs a
+lookup instead of a failing request for every offending message. Snapshots are built from the
+cached guild state and dropped when roles, channels or the bot's own member change.
+"""
+import logging
+
+import discord
+
+log = logging.getLogger("red.breadcogs.automod.permissions")
+
+# permission needed for every action, `delete` is checked per channel
+ACTION_PERMISSIONS = {
+    "delete": "manage_messages",
+    "add_role": "manage_roles",
+    "kick": "kick_members",
+    "ban": "ban_members",
+}
+
+
+class GuildPermissions:
+    __slots__ = ("manage_roles", "kick_members", "ban_members", "top_position", "owner_id", "channels")
+
+    def __init__(self, guild: discord.Guild):
+        me = guild.me
+        permissions = me.guild_permissions
+        self.manage_roles = permissions.manage_roles
+        self.kick_members = permissions.kick_members
+        self.ban_members = permissions.ban_members
+        self.top_position = me.top_role.position
+        self.owner_id = guild.owner_id
+        # channel id -> manage_messages, filled as channels are seen
+        self.channels = {}
+
+    def can_delete(self, channel: discord.TextChannel) -> bool:
+        allowed = self.channels.get(channel.id)
+        if allowed is None:
+            allowed = self.channels[channel.id] = channel.permissions_for(channel.guild.me).manage_messages
+        return allowed
+
+    def outranks(self, member: discord.Member) -> bool:
+        """Whether the bot's top role is above member's, nobody outranks the owner"""
+        return member.id != self.owner_id and member.top_role.position < self.top_position
+
+    def can_punish(self, action: str, member: discord.Member) -> bool:
+        return getattr(self, ACTION_PERMISSIONS[action]) and self.outranks(member)
+
+    def can_add_role(self, role: discord.Role) -> bool:
+        return self.manage_roles and role.position < self.top_position
+
+
+class PermissionCache:
+    def __init__(self):
+        self._guilds = {}
+        self.skipped = 0
+
+    def get(self, guild: discord.Guild) -> GuildPermissions:
+        snapshot = self._guilds.get(guild.id)
+        if snapshot is None:
+            snapshot = self._guilds[guild.id] = GuildPermissions(guild)
+        return snapshot
+
+    def invalidate(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+    def invalidate_channel(self, channel: discord.abc.GuildChannel) -> None:
+        snapshot = self._guilds.get(channel.guild.id)
+        if snapshot is not None:
+            snapshot.channels.pop(channel.id, None)
+
+    def missing(self, guild: discord.Guild, rule_plans) -> {str: [str]}:
+        """
+        Permissions the configured rules need but the bot lacks
+
+        Returns
+        -------
+        {str: [str]}
+            permission name -> names of the rules that need it
+        """
+        snapshot = self.get(guild)
+        missing = {}
+
+        def need(permission: str, rule_name: str):
+            missing.setdefault(permission, []).append(rule_name)
+
+        for rule_plan in rule_plans:
+            if not rule_plan.is_enabled:
+                continue
+            if rule_plan.delete_message:
+                channels = [guild.get_channel(c) for c in rule_plan.enforced_channels] or guild.text_channels
+                if any(c is not None and not snapshot.can_delete(c) for c in channels):
+                    need("manage_messages", rule_plan.rule_name)
+
+            action = rule_plan.action_to_take
+            if action in ("kick", "ban") and not getattr(snapshot, ACTION_PERMISSIONS[action]):
+                need(ACTION_PERMISSIONS[action], rule_plan.rule_name)
+            elif action == "add_role" and rule_plan.role_to_add:
+                role = guild.get_role(rule_plan.role_to_add)
+                if not snapshot.manage_roles:
+                    need("manage_roles", rule_plan.rule_name)
+                elif role is not None and not snapshot.can_add_role(role):
+                    need("a role above the role to add", rule_plan.rule_name)
+        return missing
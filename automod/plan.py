@@ -0,0 +1,244 @@
+from collections import defaultdict, OrderedDict
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Callable, FrozenSet, Mapping, Optional, Iterable
+import asyncio
+import itertools
+import logging
+
+import discord
+
+from .constants import DEFAULT_DIGEST_WINDOW, DEFAULT_RAID_SETTINGS, DEFAULT_STRIKE_SETTINGS
+from .recent import DEFAULT_RECENT_DEPTH
+
+log = logging.getLogger("red.breadcogs.automod.plan")
+
+
+@dataclass(frozen=True)
+class RulePlan:
+    """Immutable snapshot of a single rule's settings for one guild"""
+
+    rule_name: str
+    is_enabled: bool
+    action_to_take: str
+    delete_message: bool
+    send_dm: bool
+    role_to_add: Optional[int]
+    whitelist_roles: FrozenSet[int]
+    enforced_channels: FrozenSet[int]
+    options: Mapping
+    # minutes of the offender's recent messages to delete along with the offending one, 0 is off
+    purge_minutes: int = 0
+
+    def is_enforced_channel(self, channel_id: int) -> bool:
+        """No enforced channels means the rule is global"""
+        return not self.enforced_channels or channel_id in self.enforced_channels
+
+    def role_is_whitelisted(self, role_ids: Iterable[int]) -> bool:
+        return not self.whitelist_roles.isdisjoint(role_ids)
+
+
+@dataclass(frozen=True)
+class GuildRulePlan:
+    """
+    Everything the message listener needs to evaluate a guild, compiled once from config.
+
+    A plan is never mutated, when settings change a new plan is built and swapped in.
+    While a guild is raided the stricter variant from each rule's `build_raid_plan` is served instead.
+    """
+
+    guild_id: int
+    version: int
+    is_announcement_enabled: bool
+    announcement_channel: Optional[int]
+    digest_window: float
+    raid_settings: Mapping
+    strike_settings: Mapping
+    recent_depth: int
+    rules: Mapping
+    is_raid: bool = False
+
+    def get_rule(self, rule_name: str) -> RulePlan:
+        return self.rules[rule_name]
+
+    @property
+    def is_purging(self) -> bool:
+        """Whether any enabled rule purges recent messages, only then are they tracked"""
+        return any(rule.is_enabled and rule.purge_minutes for rule in self.rules.values())
+
+
+class RulePlanStore:
+    """
+    Holds the compiled rule plan of guilds, keyed by guild id.
+
+    Rules register themselves on creation so the store knows how to compile their settings,
+    every setter must call `invalidate` after writing to config. The store keeps at most as many
+    plans as the bot has guilds (never less than `MIN_SIZE`), least recently used plans are evicted first.
+    """
+
+    MIN_SIZE = 32
+
+    def __init__(self, config, size_hint: Callable[[], int] = None):
+        self.config = config
+        self.size_hint = size_hint
+        self._rules = {}
+        self._plans = OrderedDict()
+        self._generations = defaultdict(int)
+        self._versions = itertools.count(1)
+        self._raids = set()
+        # guild id -> (version of the plan it was derived from, raid plan)
+        self._raid_plans = {}
+        # guild id -> plan being built
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self) -> int:
+        if self.size_hint is None:
+            return self.MIN_SIZE
+        return max(self.size_hint(), self.MIN_SIZE)
+
+    def register(self, rule) -> None:
+        self._rules[rule.rule_name] = rule
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._plans),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "raids": len(self._raids),
+        }
+
+    def set_raid(self, guild_id: int, is_raid: bool) -> None:
+        """Serves the stricter raid plan for guild until turned off again"""
+        if is_raid:
+            self._raids.add(guild_id)
+        else:
+            self._raids.discard(guild_id)
+            self._raid_plans.pop(guild_id, None)
+
+    def _raid_plan(self, plan: GuildRulePlan) -> GuildRulePlan:
+        cached = self._raid_plans.get(plan.guild_id)
+        if cached is not None and cached[0] == plan.version:
+            return cached[1]
+
+        rules = {
+            rule_name: self._rules[rule_name].build_raid_plan(rule_plan)
+            for rule_name, rule_plan in plan.rules.items()
+        }
+        raid_plan = replace(
+            plan, version=next(self._versions), rules=MappingProxyType(rules), is_raid=True,
+        )
+        self._raid_plans[plan.guild_id] = (plan.version, raid_plan)
+        return raid_plan
+
+    async def get(self, guild: discord.Guild, raid: bool = True) -> GuildRulePlan:
+        """
+        Returns the current plan for guild, config is only read when no plan exists yet
+
+        With `raid` off the plan as configured is returned even while the guild is raided.
+        """
+        plan = self._plans.get(guild.id)
+        if plan is None:
+            self.misses += 1
+            # messages arriving while a plan compiles wait for that build instead of starting their own
+            building = self._building.get(guild.id)
+            if building is None:
+                building = self._building[guild.id] = asyncio.ensure_future(self._build(guild))
+                building.add_done_callback(lambda _: self._building.pop(guild.id, None))
+            plan = await asyncio.shield(building)
+        else:
+            self.hits += 1
+            self._plans.move_to_end(guild.id)
+
+        if raid and guild.id in self._raids:
+            return self._raid_plan(plan)
+        return plan
+
+    async def invalidate(self, guild: discord.Guild, rule_name: str = None) -> None:
+        """
+        Refreshes the plan for guild after a settings write
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild whose settings changed
+        rule_name: str, Optional
+            Only recompile this rule, the rest of the plan is kept as is.
+            When omitted the whole plan is dropped and rebuilt on next use.
+        """
+        self._generations[guild.id] += 1
+        plan = self._plans.pop(guild.id, None)
+        if plan is None or rule_name is None:
+            return
+
+        generation = self._generations[guild.id]
+        data = {}
+        for key in (rule_name, "settings"):
+            try:
+                data[key] = await self.config.guild(guild).get_raw(key)
+            except KeyError:
+                data[key] = {}
+        rule = self._rules[rule_name]
+        options = await rule.compile_options(data)
+
+        if self._generations[guild.id] != generation:
+            # another write came in meanwhile, let the next read rebuild everything
+            return
+        rules = dict(plan.rules)
+        rules[rule_name] = rule.build_plan(data, options)
+        self._store(
+            guild.id,
+            replace(plan, version=next(self._versions), rules=MappingProxyType(rules)),
+        )
+
+    def _store(self, guild_id: int, plan: GuildRulePlan) -> None:
+        self._plans[guild_id] = plan
+        self._plans.move_to_end(guild_id)
+        while len(self._plans) > self.max_size:
+            self._plans.popitem(last=False)
+            self.evictions += 1
+
+    async def _build(self, guild: discord.Guild) -> GuildRulePlan:
+        generation = self._generations[guild.id]
+        data = await self.config.guild(guild).all()
+        options = {rule_name: await rule.compile_options(data) for rule_name, rule in self._rules.items()}
+        plan = self.compile(guild.id, data, options)
+        # a write landed while we were reading config, the newer build wins
+        if self._generations[guild.id] == generation:
+            self._store(guild.id, plan)
+        return plan
+
+    def compile(self, guild_id: int, data: dict, options: dict = None) -> GuildRulePlan:
+        """`options` maps rule names to options built by `compile_options`, missing ones are built here"""
+        settings = data.get("settings", {})
+        options = options or {}
+        rules = {
+            rule_name: rule.build_plan(data, options.get(rule_name)) for rule_name, rule in self._rules.items()
+        }
+        return GuildRulePlan(
+            guild_id=guild_id,
+            version=next(self._versions),
+            is_announcement_enabled=settings.get("is_announcement_enabled", False),
+            announcement_channel=settings.get("announcement_channel"),
+            digest_window=settings.get("digest_window", DEFAULT_DIGEST_WINDOW),
+            raid_settings=MappingProxyType({**DEFAULT_RAID_SETTINGS, **settings.get("raid", {})}),
+            strike_settings=MappingProxyType(
+                {
+                    **DEFAULT_STRIKE_SETTINGS,
+                    **settings.get("strikes", {}),
+                    "thresholds": MappingProxyType(
+                        {
+                            **DEFAULT_STRIKE_SETTINGS["thresholds"],
+                            **settings.get("strikes", {}).get("thresholds", {}),
+                        }
+                    ),
+                }
+            ),
+            recent_depth=settings.get("recent_depth", DEFAULT_RECENT_DEPTH),
+            rules=MappingProxyType(rules),
+        )
@@ -0,0 +1,148 @@
+"""
+Join raid detection.
+
+Joins are counted per guild in a ring of time slots, each slot also keeps a small histogram of
+how old the joining accounts are. When a guild sees too many joins, or too many fresh accounts,
+it is switched into a raid state and messages are checked against a stricter plan until it ends.
+"""
+from array import array
+from bisect import bisect_right
+import asyncio
+import datetime
+import logging
+import time
+
+import discord
+
+log = logging.getLogger("red.breadcogs.automod.raid")
+
+# upper edges of the account age buckets in seconds, older accounts fall in the last bucket
+AGE_BUCKETS = (3600, 86400, 7 * 86400, 30 * 86400)
+AGE_LABELS = ("1h", "1d", "7d", "30d", "older")
+
+
+def account_age(member: discord.Member, now: float) -> float:
+    return now - member.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class JoinCounter:
+    """
+    Sliding window of joins for one guild split in `SLOTS` slots.
+
+    Every slot stores how many accounts of each age bucket joined in it, about a kilobyte per
+    guild whatever the window or join volume.
+    """
+
+    SLOTS = 60
+    __slots__ = ("seconds", "resolution", "_stamps", "_counts")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.resolution = seconds / self.SLOTS
+        self._stamps = array("q", [-1] * self.SLOTS)
+        self._counts = array("H", [0] * (self.SLOTS * len(AGE_LABELS)))
+
+    def add(self, now: float, age: float) -> None:
+        tick = int(now // self.resolution)
+        slot = tick % self.SLOTS
+        width = len(AGE_LABELS)
+        start = slot * width
+        if self._stamps[slot] != tick:
+            self._stamps[slot] = tick
+            for i in range(start, start + width):
+                self._counts[i] = 0
+
+        index = start + bisect_right(AGE_BUCKETS, age)
+        # "H" holds 65535, a bigger burst is a raid long before that
+        if self._counts[index] < 0xFFFF:
+            self._counts[index] += 1
+
+    def histogram(self, now: float) -> [int]:
+        """Joins in the window per age bucket"""
+        tick = int(now // self.resolution)
+        width = len(AGE_LABELS)
+        totals = [0] * width
+        for slot, stamp in enumerate(self._stamps):
+            if tick - self.SLOTS < stamp <= tick:
+                start = slot * width
+                for i in range(width):
+                    totals[i] += self._counts[start + i]
+        return totals
+
+
+class RaidDetector:
+    """
+    Watches member joins and switches guilds in and out of the raid state.
+
+    `on_change(guild_id, is_raid, histogram)` is awaited whenever a raid starts or ends.
+    """
+
+    def __init__(self, plans, on_change):
+        self.plans = plans
+        self.on_change = on_change
+        self._counters = {}
+        self._lifts = {}
+
+    def counter(self, guild_id: int, seconds: float) -> JoinCounter:
+        counter = self._counters.get(guild_id)
+        if counter is None or counter.seconds != seconds:
+            counter = self._counters[guild_id] = JoinCounter(seconds)
+        return counter
+
+    def histogram(self, guild_id: int) -> [int]:
+        counter = self._counters.get(guild_id)
+        if counter is None:
+            return [0] * len(AGE_LABELS)
+        return counter.histogram(time.time())
+
+    def is_raid(self, guild_id: int) -> bool:
+        return guild_id in self._lifts
+
+    async def on_join(self, member: discord.Member) -> bool:
+        """Counts the join, returns True when it started a raid"""
+        plan = await self.plans.get(member.guild)
+        settings = plan.raid_settings
+        if not settings["enabled"]:
+            return False
+
+        now = time.time()
+        joins, seconds = settings["join_limit"]
+        counter = self.counter(member.guild.id, seconds)
+        counter.add(now, account_age(member, now))
+
+        histogram = counter.histogram(now)
+        young = sum(histogram[: AGE_BUCKETS.index(settings["young_age"]) + 1])
+        if sum(histogram) < joins and young < settings["young_limit"]:
+            return False
+
+        is_new = not self.is_raid(member.guild.id)
+        self.start(member.guild.id, settings["duration"])
+        if is_new:
+            log.info(f"Raid detected in {member.guild} ({member.guild.id}), joins per age: {histogram}")
+            asyncio.create_task(self.on_change(member.guild.id, True, histogram))
+        return is_new
+
+    def start(self, guild_id: int, duration: float) -> None:
+        """Enters or extends the raid state of guild"""
+        handle = self._lifts.pop(guild_id, None)
+        if handle is not None:
+            handle.cancel()
+        self.plans.set_raid(guild_id, True)
+        self._lifts[guild_id] = asyncio.get_running_loop().call_later(duration, self.end, guild_id)
+
+    def end(self, guild_id: int) -> bool:
+        """Leaves the raid state, returns False when guild was not in it"""
+        handle = self._lifts.pop(guild_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        self.plans.set_raid(guild_id, False)
+        log.info(f"Raid state ended in guild {guild_id}")
+        asyncio.create_task(self.on_change(guild_id, False, self.histogram(guild_id)))
+        return True
+
+    def cancel(self) -> None:
+        for guild_id, handle in self._lifts.items():
+            handle.cancel()
+            self.plans.set_raid(guild_id, False)
+        self._lifts.clear()
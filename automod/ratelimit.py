@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from hashlib import blake2b
+import math
+
+
+def content_key(content: str) -> int:
+    """Compact 64 bit fingerprint of a message's content"""
+    return int.from_bytes(blake2b(content.encode(), digest_size=8).digest(), "little")
+
+
+class ExpiringStore:
+    """
+    Mapping with a hard size limit whose entries expire `ttl` seconds after their last write.
+
+    Expiry is driven by a timing wheel, each slot holds the keys due in that tick so advancing
+    time only touches keys that actually expire. When full, the least recently written key is evicted.
+    """
+
+    __slots__ = (
+        "ttl",
+        "max_size",
+        "resolution",
+        "_entries",
+        "_wheel",
+        "_tick",
+        "expirations",
+        "evictions",
+    )
+
+    def __init__(self, ttl: float, max_size: int, resolution: float = 1.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.resolution = resolution
+        # key -> [value, tick the key expires at]
+        self._entries = OrderedDict()
+        # one more slot than the ttl spans so a deadline never wraps onto the current tick
+        self._wheel = [set() for _ in range(math.ceil(ttl / resolution) + 2)]
+        self._tick = None
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def advance(self, now: float) -> None:
+        """Drops every entry that expired by `now`"""
+        tick = int(now // self.resolution)
+        if self._tick is None:
+            self._tick = tick
+            return
+        if tick <= self._tick:
+            return
+
+        slots = len(self._wheel)
+        start = max(self._tick + 1, tick - slots + 1)
+        for current in range(start, tick + 1):
+            slot = self._wheel[current % slots]
+            for key in slot:
+                del self._entries[key]
+            self.expirations += len(slot)
+            slot.clear()
+        self._tick = tick
+
+    def get(self, key, now: float, default=None):
+        self.advance(now)
+        entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, now: float) -> None:
+        self.advance(now)
+        slots = len(self._wheel)
+        deadline = int((now + self.ttl) // self.resolution) + 1
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._wheel[entry[1] % slots].discard(key)
+        elif len(self._entries) >= self.max_size:
+            oldest, (_, oldest_deadline) = self._entries.popitem(last=False)
+            self._wheel[oldest_deadline % slots].discard(oldest)
+            self.evictions += 1
+
+        self._entries[key] = [value, deadline]
+        self._wheel[deadline % slots].add(key)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._wheel[entry[1] % len(self._wheel)].discard(key)
+        return entry[0]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class GCRALimiter:
+    """
+    Generic cell rate algorithm, `rate` hits are allowed every `per` seconds with bursts up to `rate`.
+
+    Each key only stores one int, the theoretical arrival time of its next hit in microseconds.
+    Epoch timestamps are too large for float sums to stay exact, so times are kept in whole ticks.
+    """
+
+    TICKS = 1_000_000
+
+    __slots__ = ("rate", "per", "interval", "tolerance", "store")
+
+    def __init__(self, rate: int, per: float, max_size: int):
+        self.rate = rate
+        self.per = per
+        per_ticks = round(per * self.TICKS)
+        self.interval = per_ticks // rate
+        self.tolerance = per_ticks - self.interval
+        # once the arrival time is in the past the key is as good as new, so it can expire
+        self.store = ExpiringStore(ttl=per, max_size=max_size)
+
+    def hit(self, key, now: float) -> bool:
+        """Records a hit for key and returns True when it goes over the limit"""
+        now_ticks = round(now * self.TICKS)
+        arrival = max(self.store.get(key, now, now_ticks), now_ticks)
+        if arrival - now_ticks > self.tolerance:
+            return True
+
+        self.store.set(key, arrival + self.interval, now)
+        return False
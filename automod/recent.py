@@ -0,0 +1,150 @@
+"""
+Recent messages per channel, so an offender's earlier messages can be purged without history fetches.
+
+Every channel keeps a ring of its last `depth` message ids and author ids in two flat arrays.
+Message ids are snowflakes and carry their creation time, a ring is ordered by id so a lookup
+walks back from the newest message and stops at the first one older than asked for.
+"""
+from array import array
+import time
+
+import discord
+
+DISCORD_EPOCH = 1420070400000
+
+DEFAULT_RECENT_DEPTH = 50
+MAX_RECENT_DEPTH = 500
+
+
+def snowflake_at(timestamp: float) -> int:
+    """Smallest snowflake created at unix `timestamp`"""
+    return max(int(timestamp * 1000) - DISCORD_EPOCH, 0) << 22
+
+
+class RecentMessage:
+    """
+    Stand-in for `discord.PartialMessage`, which only exists from discord.py 1.6
+
+    Just enough of a message for the delete batcher, no message is fetched.
+    """
+
+    __slots__ = ("id", "channel")
+
+    def __init__(self, channel: discord.TextChannel, message_id: int):
+        self.id = message_id
+        self.channel = channel
+
+    @property
+    def created_at(self):
+        return discord.utils.snowflake_time(self.id)
+
+    async def delete(self) -> None:
+        await self.channel._state.http.delete_message(self.channel.id, self.id)
+
+
+def partial_message(channel: discord.TextChannel, message_id: int):
+    """A deletable message from its id on any discord.py version"""
+    get_partial_message = getattr(channel, "get_partial_message", None)
+    if get_partial_message is not None:
+        return get_partial_message(message_id)
+    return RecentMessage(channel, message_id)
+
+
+class ChannelRing:
+    __slots__ = ("message_ids", "author_ids", "position")
+
+    def __init__(self, depth: int):
+        self.message_ids = array("Q", bytes(8 * depth))
+        self.author_ids = array("Q", bytes(8 * depth))
+        self.position = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.message_ids)
+
+    @property
+    def newest(self) -> int:
+        return self.message_ids[self.position - 1]
+
+    def add(self, message_id: int, author_id: int) -> None:
+        self.message_ids[self.position] = message_id
+        self.author_ids[self.position] = author_id
+        self.position = (self.position + 1) % len(self.message_ids)
+
+    def pop_author(self, author_id: int, after: int) -> [int]:
+        """Ids of author's messages newer than snowflake `after`, they are dropped from the ring"""
+        message_ids = self.message_ids
+        author_ids = self.author_ids
+        found = []
+        index = self.position
+        for _ in range(len(message_ids)):
+            index -= 1
+            message_id = message_ids[index]
+            # empty slots are 0, so this also stops at the start of a ring that isn't full yet
+            if message_id <= after:
+                break
+            if author_ids[index] == author_id:
+                found.append(message_id)
+                author_ids[index] = 0
+        return found
+
+    def resized(self, depth: int) -> "ChannelRing":
+        """A ring of another depth holding the newest messages of this one"""
+        ring = ChannelRing(depth)
+        count = min(depth, self.depth)
+        for offset in range(count, 0, -1):
+            index = (self.position - offset) % self.depth
+            if self.message_ids[index]:
+                ring.add(self.message_ids[index], self.author_ids[index])
+        return ring
+
+
+class RecentMessages:
+    def __init__(self):
+        # guild id -> {channel id: ChannelRing}
+        self._guilds = {}
+        self.purges = 0
+        self.purged = 0
+
+    def stats(self) -> dict:
+        rings = [ring for channels in self._guilds.values() for ring in channels.values()]
+        return {
+            "channels": len(rings),
+            "slots": sum(ring.depth for ring in rings),
+            "purges": self.purges,
+            "purged": self.purged,
+        }
+
+    def add(self, message: discord.Message, depth: int) -> None:
+        channels = self._guilds.setdefault(message.guild.id, {})
+        ring = channels.get(message.channel.id)
+        if ring is None:
+            ring = channels[message.channel.id] = ChannelRing(depth)
+        elif ring.depth != depth:
+            ring = channels[message.channel.id] = ring.resized(depth)
+        ring.add(message.id, message.author.id)
+
+    def pop_author(self, guild_id: int, author_id: int, minutes: float) -> {int: [int]}:
+        """
+        Message ids of author in the last `minutes` per channel id
+
+        Returned messages are forgotten, purging the same author again only finds newer messages.
+        """
+        after = snowflake_at(time.time() - minutes * 60)
+        found = {}
+        for channel_id, ring in self._guilds.get(guild_id, {}).items():
+            # quiet channels are skipped without walking their ring
+            if ring.newest <= after:
+                continue
+            message_ids = ring.pop_author(author_id, after)
+            if message_ids:
+                found[channel_id] = message_ids
+        self.purges += 1
+        self.purged += sum(len(message_ids) for message_ids in found.values())
+        return found
+
+    def forget_channel(self, channel: discord.abc.GuildChannel) -> None:
+        self._guilds.get(channel.guild.id, {}).pop(channel.id, None)
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
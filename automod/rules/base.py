@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import Optional
 
 import discord
@@ -14,8 +14,9 @@ from ..constants import (
     DEFAULT_OPTIONS,
     OPTIONS_MAP,
 )
-from async_lru import alru_cache
-import timeit
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
+from types import MappingProxyType
 
 
 @dataclass()
@@ -31,21 +32,76 @@ class BaseRuleSettingsDisplay:
 
 
 class BaseRule:
+    # whether the verdict only depends on the message itself, such rules are re-run when a message is edited
+    is_content_rule = True
+    # whether the verdict depends on nothing but the content and the plan, such verdicts are memoized
+    is_memoized = False
+    # whether checking a message updates state later messages are judged by, such rules see every message
+    is_stateful = False
+    # rough microseconds per `is_offensive` call, only used until real timings come in
+    cost = 10
+
     def __init__(
-        self, config, *args, **kwargs,
+        self, config, plans, *args, **kwargs,
     ):
         super().__init__(
             *args, **kwargs,
         )
         self.config = config
+        self.plans = plans
         self.rule_name = self.__class__.__name__
+        self.plans.register(self)
 
     @abstractmethod
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
         pass
 
+    def build_options(self, data: dict,) -> dict:
+        """Rule specific parameters to compile into the rule plan, `data` is the whole guild config"""
+        return {}
+
+    async def compile_options(self, data: dict,) -> dict:
+        """`build_options` for the plan store, rules with expensive options build them off the event loop"""
+        return self.build_options(data)
+
+    def build_plan(self, data: dict, options: dict = None,) -> RulePlan:
+        """
+        Compiles this rule's settings from the guild config into an immutable plan
+
+        `options` are the already built rule specific parameters, built from `data` when omitted
+        """
+        settings = data.get(self.rule_name, {})
+        return RulePlan(
+            rule_name=self.rule_name,
+            is_enabled=settings.get("is_enabled", False),
+            action_to_take=settings.get("action_to_take", DEFAULT_ACTION),
+            delete_message=settings.get("delete_message", False),
+            send_dm=settings.get("send_dm", False),
+            role_to_add=settings.get("role_to_add"),
+            whitelist_roles=frozenset(settings.get("whitelist_roles") or ()),
+            enforced_channels=frozenset(settings.get("enforced_channels") or ()),
+            options=MappingProxyType(self.build_options(data) if options is None else options),
+            purge_minutes=settings.get("purge_minutes", 0),
+        )
+
+    def is_channel_scoped(self, plan: RulePlan, channel_id: int,) -> bool:
+        """Whether a memoized verdict in this channel can differ from other channels"""
+        return False
+
+    def build_raid_options(self, options: dict,) -> dict:
+        """Stricter rule specific parameters used while the guild is raided"""
+        return options
+
+    def build_raid_plan(self, plan: RulePlan,) -> RulePlan:
+        """The plan used while the guild is raided, enabled rules always delete the message"""
+        return replace(
+            plan,
+            delete_message=plan.delete_message or plan.is_enabled,
+            options=MappingProxyType(self.build_raid_options(dict(plan.options))),
+        )
+
     async def get_settings(self, guild: discord.Guild,) -> BaseRuleSettingsDisplay:
         return BaseRuleSettingsDisplay(
             rule_name=self.rule_name,
@@ -58,24 +114,15 @@ class BaseRule:
             muted_role=await self.get_mute_role(guild),
         )
 
-    async def _clear_cache(
-        self, func,
-    ):
-        """Function helper to clear cache"""
-        try:
-            await func.cache_clear()
-        except TypeError:
-            # cache probably cleared already
-            pass
+    async def get_plan(self, guild: discord.Guild,) -> RulePlan:
+        """Returns this rule's compiled settings for guild"""
+        plan = await self.plans.get(guild)
+        return plan.get_rule(self.rule_name)
 
     # enabling
-    @alru_cache(maxsize=32)
     async def is_enabled(self, guild: discord.Guild,) -> bool:
         """Helper to return the status of Rule"""
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "is_enabled",)
-        except KeyError:
-            return False
+        return (await self.get_plan(guild)).is_enabled
 
     async def toggle_enabled(
         self, guild: discord.Guild, toggle: ToggleBool,
@@ -84,7 +131,6 @@ class BaseRule:
         bool,
     ):
         """Toggles whether the rule is in effect"""
-        await self._clear_cache(self.is_enabled)
         before = False
         try:
             before = await self.config.guild(guild).get_raw(self.rule_name, "is_enabled",)
@@ -94,6 +140,7 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "is_enabled", value=toggle,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
         return (
             before,
@@ -104,8 +151,6 @@ class BaseRule:
         self, guild: discord.Guild, channels: [discord.TextChannel],
     ):
         """Setting a channel will disable global"""
-        await self._clear_cache(self.get_enforced_channels)
-
         config_channels = []
 
         for channel in channels:
@@ -115,66 +160,36 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "enforced_channels", value=config_channels,
         )
+        await self.plans.invalidate(guild, self.rule_name)
         return config_channels
 
-    @alru_cache(maxsize=32)
-    async def get_enforced_channels(self, guild: discord.Guild,) -> [discord.TextChannel]:
-        """Returns enabled channels, empty list if none set"""
-
-        channels = []
-        try:
-            channels = await self.config.guild(guild).get_raw(self.rule_name, "enforced_channels",)
-        except KeyError:
-            pass
-
-        return channels
+    async def get_enforced_channels(self, guild: discord.Guild,) -> [int]:
+        """Returns enabled channel ids, empty list if none set"""
+        return list((await self.get_plan(guild)).enforced_channels)
 
     async def is_enforced_channel(
         self, guild: discord.Guild, channel: discord.TextChannel,
     ):
-        enforced_channels = await self.get_enforced_channels(guild)
-        # global
-        if not enforced_channels:
-            return True
-
-        if channel.id in enforced_channels:
-            return True
-
-        return False
+        return (await self.get_plan(guild)).is_enforced_channel(channel.id)
 
     # actions
-    @alru_cache(maxsize=32)
     async def get_action_to_take(self, guild: discord.Guild,) -> str:
         """Helper to return what action is currently set on offence"""
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "action_to_take",)
-        except KeyError:
-            await self.config.guild(guild).set_raw(
-                self.rule_name, "action_to_take", value=DEFAULT_ACTION,
-            )
-            return DEFAULT_ACTION
+        return (await self.get_plan(guild)).action_to_take
 
     async def set_action_to_take(
         self, action: str, guild: discord.Guild,
     ):
         """Sets the action to take on an offence"""
-        try:
-            await self.get_action_to_take.cache_clear()
-        except TypeError:
-            # cache probably not exists or clear already
-            pass
         await self.config.guild(guild).set_raw(
             self.rule_name, "action_to_take", value=action,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
-    @alru_cache(maxsize=32)
     async def get_should_delete(
         self, guild: discord.Guild,
     ):
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "delete_message",)
-        except KeyError:
-            return False
+        return (await self.get_plan(guild)).delete_message
 
     async def toggle_to_delete_message(
         self, guild: discord.Guild,
@@ -183,7 +198,6 @@ class BaseRule:
         bool,
     ):
         """Toggles whether offending message should be deleted"""
-        await self._clear_cache(self.get_should_delete)
         try:
             before = await self.config.guild(guild).get_raw(self.rule_name, "delete_message",)
         except KeyError:
@@ -191,32 +205,30 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "delete_message", value=not before,
         )
+        await self.plans.invalidate(guild, self.rule_name)
         return (
             before,
             not before,
         )
 
+    async def get_purge_minutes(self, guild: discord.Guild,) -> int:
+        return (await self.get_plan(guild)).purge_minutes
+
+    async def set_purge_minutes(self, guild: discord.Guild, minutes: int,) -> None:
+        """Sets how many minutes of the offender's messages are deleted on offence, 0 turns it off"""
+        await self.config.guild(guild).set_raw(
+            self.rule_name, "purge_minutes", value=minutes,
+        )
+        await self.plans.invalidate(guild, self.rule_name)
+
     async def role_is_whitelisted(self, guild: discord.Guild, roles: [discord.Role],) -> bool:
         """Checks if role is whitelisted"""
-        try:
-            whitelist_roles = await self.config.guild(guild).get_raw(
-                self.rule_name, "whitelist_roles",
-            )
-        except KeyError:
-            # no roles are whitelisted
-            return False
-
-        # return any(role in whitelist_roles for role in [role.id for role in roles])
-        for role in roles:
-            if role.id in whitelist_roles:
-                return True
-        return False
+        return (await self.get_plan(guild)).role_is_whitelisted(role.id for role in roles)
 
     async def append_whitelist_role(
         self, guild: discord.Guild, role: discord.Role,
     ):
         """Adds role to whitelist"""
-        await self._clear_cache(self.get_all_whitelisted_roles)
         try:
             roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles",)
             if role.id in roles:
@@ -229,15 +241,15 @@ class BaseRule:
 
         except KeyError:
             # no roles added yet
-            return await self.config.guild(guild).set_raw(
+            await self.config.guild(guild).set_raw(
                 self.rule_name, "whitelist_roles", value=[role.id],
             )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def remove_whitelist_role(
         self, guild: discord.Guild, role: discord.Role,
     ):
         """Removes role from whitelist"""
-        await self._clear_cache(self.get_all_whitelisted_roles)
         roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles",)
         if not role.id in roles:
             raise ValueError("That role is not whitelisted")
@@ -247,17 +259,16 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "whitelist_roles", value=roles,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
-    @alru_cache(maxsize=32)
     async def get_all_whitelisted_roles(
         self, guild: discord.Guild,
     ):
-        try:
-            roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles",)
-        except KeyError:
+        roles = (await self.get_plan(guild)).whitelist_roles
+        if not roles:
             # no roles added
             return None
-        return roles
+        return list(roles)
 
     async def toggle_sending_message(
         self, guild: discord.Guild,
@@ -275,16 +286,14 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "send_dm", value=(not before),
         )
+        await self.plans.invalidate(guild, self.rule_name)
         return (
             before,
             not before,
         )
 
     async def get_mute_role(self, guild: discord.Guild,) -> str or None:
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "role_to_add",)
-        except KeyError:
-            return None
+        return (await self.get_plan(guild)).role_to_add
 
     async def set_mute_role(self, guild: discord.Guild, role: discord.Role,) -> tuple:
 
@@ -298,6 +307,7 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "role_to_add", value=role.id,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
         before_role = None
         if before:
@@ -318,15 +328,21 @@ class BaseRule:
         message_has_been_deleted: bool,
         action_taken_success: bool,
         action_taken=None,
+        analysis: MessageAnalysis = None,
+        rule_names: [str] = None,
     ) -> discord.Embed:
+        """`rule_names` lists every rule the message broke when it was more than this one"""
+        rule_names = rule_names or [self.rule_name]
+        if analysis is None:
+            analysis = MessageAnalysis(message)
         shortened_message_content = (
             (message.content[:120] + " .... (shortened)")
-            if len(message.content.split()) > 25
+            if analysis.word_count > 25
             else message.content
         )
 
         embed = discord.Embed(
-            title=f"{self.rule_name} - Offense found",
+            title=f"{', '.join(rule_names)} - Offense found",
             description=f"```{shortened_message_content}```",
             color=discord.Color.gold(),
         )
@@ -1,17 +1,26 @@
 import discord
-import re
 
 from .base import BaseRule
+from ..analysis import MessageAnalysis, invite_code
+from ..plan import RulePlan
 from ..utils import *
 
 
 class DiscordInviteRule(BaseRule):
+    cost = 5
+    is_memoized = True
+
     def __init__(
-        self, config,
+        self, config, plans,
     ):
-        super().__init__(config)
+        super().__init__(config, plans)
         self.name = "discordinvite"
 
+    def build_options(self, data: dict,) -> dict:
+        """Allowed links are kept as invite codes, so any form of an allowed link is allowed"""
+        allowed_links = data.get(self.rule_name, {}).get("allowed_links") or ()
+        return {"allowed_codes": frozenset(invite_code(link) or link for link in allowed_links)}
+
     async def get_allowed_links(
         self, guild: discord.Guild,
     ):
@@ -40,6 +49,7 @@ class DiscordInviteRule(BaseRule):
             await self.config.guild(guild).set_raw(
                 self.rule_name, "allowed_links", value=[link],
             )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def delete_allowed_link(
         self, guild: discord.Guild, link: str,
@@ -48,28 +58,18 @@ class DiscordInviteRule(BaseRule):
         if current_links is None or link not in current_links:
             raise ValueError("Link provided is not in the allowed list.")
 
-        current_links.pop(link)
+        current_links.remove(link)
         await self.config.guild(guild).set_raw(
             self.rule_name, "allowed_links", value=current_links,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
-        author = message.author
-        guild = message.guild
-        content = message.content
-
-        allowed_links = await self.get_allowed_links(guild)
-
-        r = re.compile("(https?:\/\/)?(www\.)?((discordapp\.com/invite)|(discord\.gg))\/(\w+)")
-
-        if allowed_links:
-            filter_content = [x for x in content.split() if x not in allowed_links]
-        else:
-            filter_content = content.split()
+        allowed_codes = plan.options["allowed_codes"]
 
-        has_offensive = list(filter(r.match, filter_content,))
+        has_offensive = [code for code in analysis.invite_codes if code not in allowed_codes]
 
         if has_offensive:
             return True
@@ -1,13 +1,21 @@
 import discord
 
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
 
 
 class MaxCharsRule(BaseRule):
+    cost = 1
+    is_memoized = True
+
     def __init__(
-        self, config,
+        self, config, plans,
     ):
-        super().__init__(config)
+        super().__init__(config, plans)
+
+    def build_options(self, data: dict,) -> dict:
+        return {"max_chars": data.get(self.rule_name, {}).get("max_chars")}
 
     async def set_max_chars_length(
         self, guild: discord.Guild, max_length: int,
@@ -15,6 +23,7 @@ class MaxCharsRule(BaseRule):
         await self.config.guild(guild).set_raw(
             self.rule_name, "max_chars", value=max_length,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def get_max_chars(
         self, guild: discord.Guild,
@@ -25,10 +34,10 @@ class MaxCharsRule(BaseRule):
             return None
 
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
-        content = message.content
-        max_chars = await self.get_max_chars(message.guild)
+        content = analysis.content
+        max_chars = plan.options["max_chars"]
 
         if max_chars is None:
             return False
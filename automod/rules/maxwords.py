@@ -1,14 +1,22 @@
 import discord
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
 
 
 class MaxWordsRule(BaseRule):
+    cost = 2
+    is_memoized = True
+
     def __init__(
-        self, config,
+        self, config, plans,
     ):
-        super().__init__(config)
+        super().__init__(config, plans)
         self.name = "MaxWordsRule"
 
+    def build_options(self, data: dict,) -> dict:
+        return {"max_words": data.get(self.rule_name, {}).get("max_words")}
+
     async def get_max_words_length(
         self, guild: discord.Guild,
     ):
@@ -26,15 +34,14 @@ class MaxWordsRule(BaseRule):
         await self.config.guild(guild).set_raw(
             self.rule_name, "max_words", value=max_length,
         )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
-        content = message.content.split()
-        guild = message.guild
-        max_length = await self.get_max_words_length(guild)
+        max_length = plan.options["max_words"]
         if not max_length:
             return False
 
-        if len(content) >= max_length:
+        if analysis.word_count >= max_length:
             return True
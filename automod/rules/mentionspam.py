@@ -1,38 +1,38 @@
 import discord
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
 
 from ..utils import *
 import logging
-import re
 
 log = logging.getLogger("red.breadcogs.automod")
 
 
 class MentionSpamRule(BaseRule):
+    cost = 3
+
     def __init__(
-        self, config,
+        self, config, plans,
     ):
-        super().__init__(config)
+        super().__init__(config, plans)
         self.name = "mentionspam"
 
+    def build_options(self, data: dict,) -> dict:
+        return {"mention_threshold": data.get("settings", {}).get("mention_threshold", 4)}
+
+    def build_raid_options(self, options: dict,) -> dict:
+        options["mention_threshold"] = max(options["mention_threshold"] // 2, 2)
+        return options
+
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
         author = message.author
-        content = message.content.split()
-
-        try:
-            mention_threshold = await self.config.guild(message.guild).get_raw(
-                "settings", "mention_threshold",
-            )
-        except KeyError:
-            mention_threshold = 4
 
-        mention = re.compile(r"<@!?(\d+)>")
-        allowed_mentions = [author.mention]
-        filter_content = [x for x in content if x not in allowed_mentions]
+        mention_threshold = plan.options["mention_threshold"]
 
-        mention_count = len(list(filter(mention.match, filter_content,)))
+        mention_count = sum(1 for user_id in analysis.mention_ids if user_id != author.id)
 
         if mention_count >= mention_threshold:
             return True
@@ -50,6 +50,7 @@ class MentionSpamRule(BaseRule):
         await self.config.guild(guild).set_raw(
             "settings", "mention_threshold", value=threshold,
         )
+        await self.plans.invalidate(guild, self.rule_name)
         log.info(
             f"{ctx.author} ({ctx.author.id}) changed mention threshold from {before} to {threshold}"
         )
@@ -6,59 +6,229 @@ import asyncio
 from redbot.core.data_manager import bundled_data_path
 
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
+from ..ratelimit import GCRALimiter, content_key
+from ..similarity import MIN_LENGTH, MinHasher, NearDuplicateIndex, shingles
 
-from redbot.core import commands
 import datetime
 import logging
 
 log = logging.getLogger("red.breadcogs.automod.spamrule")
 
 
-# Inspiration and some logic taken from RoboDanny
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message: discord.Message,) -> tuple:
-        return (
-            message.channel.id,
-            message.content,
-        )
+DEFAULT_USER_LIMIT = (10, 12.0)
+DEFAULT_CONTENT_LIMIT = (15, 17.0)
+# near duplicates across every channel and author of the guild, off (rate 0) until a guild opts in
+DEFAULT_SIMILAR_LIMIT = (0, 30.0)
+
+_hasher = MinHasher()
 
 
+# Inspiration and some logic taken from RoboDanny
 class SpamChecker:
+    """Spam limiters of one guild, one limiter per distinct (rate, per) in use"""
+
+    # keys tracked per limiter, the least recently seen are dropped past this
+    MAX_TRACKED_KEYS = 20_000
+
     def __init__(self,):
-        self.by_content = CooldownByContent.from_cooldown(15, 17.0, commands.BucketType.member,)
-        self.by_user = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user,)
+        self._limiters = {}
+        self._similar = None
+
+    def limiter(self, limit: tuple) -> GCRALimiter:
+        limiter = self._limiters.get(limit)
+        if limiter is None:
+            limiter = self._limiters[limit] = GCRALimiter(*limit, self.MAX_TRACKED_KEYS)
+        return limiter
+
+    def similar_index(self, window: float) -> NearDuplicateIndex:
+        if self._similar is None or self._similar.window != window:
+            self._similar = NearDuplicateIndex(_hasher, window)
+        return self._similar
+
+    def is_near_duplicate(self, analysis: MessageAnalysis, limit: tuple, now: float) -> bool:
+        rate, per = limit
+        if not rate or len(analysis.normalized) < MIN_LENGTH:
+            return False
+        signature = _hasher.signature(shingles(analysis.normalized_tokens, analysis.normalized))
+        return self.similar_index(per).add(signature, now) > rate
 
-    def is_spamming(self, message: discord.Message,) -> bool:
+    def is_spamming(self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,) -> bool:
         current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
+        user_limit = plan.options["user_limit"]
+        content_limit = plan.options["content_limit"]
+        user_key = message.author.id
+
+        channel_limits = plan.options["channel_limits"].get(message.channel.id)
+        if channel_limits is not None:
+            user_limit = channel_limits.get("user", user_limit)
+            content_limit = channel_limits.get("content", content_limit)
+            # channels with their own limits count their messages separately
+            user_key = (message.channel.id, message.author.id)
+
+        if self.limiter(user_limit).hit(user_key, current):
             return True
 
-        content_bucket = self.by_content.get_bucket(message)
-        if content_bucket.update_rate_limit(current):
+        content = content_key(f"{message.channel.id}:{message.content}")
+        if self.limiter(content_limit).hit(content, current):
             return True
 
-        return False
+        return self.is_near_duplicate(analysis, plan.options["similar_limit"], current)
+
+    def stats(self) -> [dict]:
+        stats = [limiter.store.stats() for limiter in self._limiters.values()]
+        if self._similar is not None:
+            stats.append(
+                {"size": len(self._similar), "max_size": self._similar.max_entries, "expirations": 0, "evictions": 0}
+            )
+        return stats
+
+
+class RaidCollector:
+    """
+    Collects the ids of spammers in one guild while a raid is going on.
+
+    The first detection starts a background task, ids found until the window closes are
+    flushed together and the collector starts from scratch for the next raid.
+    """
+
+    def __init__(self, guild_id: int, on_flush):
+        self.guild_id = guild_id
+        self.on_flush = on_flush
+        self.spammers = set()
+        self.task = None
+
+    def add(self, user_id: int, window: float) -> None:
+        self.spammers.add(user_id)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._collect(window))
+
+    async def _collect(self, window: float) -> None:
+        # wait before sending the file to allow the caching to catch up
+        await asyncio.sleep(window)
+        spammers, self.spammers = self.spammers, set()
+        try:
+            await self.on_flush(self.guild_id, spammers)
+        except Exception:
+            log.exception(f"Failed to send collected spammers for guild {self.guild_id}")
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
 
 
 class SpamRule(BaseRule):
     """
     1) It checks if a user has spammed more than 10 times in 12 seconds
     2) It checks if the content has been spammed 15 times in 17 seconds.
+    3) It can check if too many near identical messages were sent across the guild in a period.
+
+    The first two limits can be changed per guild and per channel. The third is off until a guild
+    sets it with `spamrule limit similar`. All of them are halved while the guild is raided.
     """
 
-    def __init__(self, config, bot, data_path, *args, **kwargs):
-        super().__init__(config, *args, **kwargs)
+    cost = 15
+    DEFAULT_COLLECT_WINDOW = 300
+    # edits are not new messages, counting them would double up the rate counters
+    is_content_rule = False
+    # every message counts towards the limits, also those already found by another rule
+    is_stateful = True
+
+    def __init__(self, config, plans, bot, data_path, *args, **kwargs):
+        super().__init__(config, plans, *args, **kwargs)
         self._spam_check = defaultdict(SpamChecker)
-        self.user_cache = []
+        self._collectors = {}
         self.bot = bot
         self.data_path = data_path
-        self.is_sleeping = False
 
-    async def make_nice_file(self, list_of_ids) -> None:
+    def build_options(self, data: dict,) -> dict:
+        settings = data.get(self.rule_name, {})
+        channel_limits = {
+            int(channel_id): {kind: tuple(limit) for kind, limit in limits.items()}
+            for channel_id, limits in settings.get("channel_limits", {}).items()
+        }
+        return {
+            "collect_window": settings.get("collect_window", self.DEFAULT_COLLECT_WINDOW),
+            "user_limit": tuple(settings.get("user_limit", DEFAULT_USER_LIMIT)),
+            "content_limit": tuple(settings.get("content_limit", DEFAULT_CONTENT_LIMIT)),
+            "similar_limit": tuple(settings.get("similar_limit", DEFAULT_SIMILAR_LIMIT)),
+            "channel_limits": channel_limits,
+        }
+
+    def build_raid_options(self, options: dict,) -> dict:
+        def halve(limit):
+            rate, per = limit
+            return (max(rate // 2, 1) if rate else rate, per)
+
+        options["user_limit"] = halve(options["user_limit"])
+        options["content_limit"] = halve(options["content_limit"])
+        options["similar_limit"] = halve(options["similar_limit"])
+        options["channel_limits"] = {
+            channel_id: {kind: halve(limit) for kind, limit in limits.items()}
+            for channel_id, limits in options["channel_limits"].items()
+        }
+        return options
+
+    async def set_limit(
+        self, guild: discord.Guild, kind: str, rate: int, per: float, channel: discord.TextChannel = None,
+    ) -> None:
+        """
+        Sets how many messages are allowed in a period
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild the limit applies to
+        kind: str
+            `user` for messages by one member, `content` for identical messages in one channel,
+            `similar` for near identical messages across the guild
+        rate: int
+            Messages allowed
+        per: float
+            Period in seconds
+        channel: discord.TextChannel, Optional
+            Only apply the limit to this channel, otherwise it is the guild default.
+            Not supported for `similar`
+
+        Returns
+        -------
+            None
+        """
+        if channel is None:
+            await self.config.guild(guild).set_raw(self.rule_name, f"{kind}_limit", value=[rate, per])
+        else:
+            await self.config.guild(guild).set_raw(
+                self.rule_name, "channel_limits", str(channel.id), kind, value=[rate, per]
+            )
+        await self.plans.invalidate(guild, self.rule_name)
+
+    async def reset_limits(self, guild: discord.Guild, channel: discord.TextChannel = None) -> None:
+        """Removes a channel's own limits, or resets the guild limits to the defaults"""
+        if channel is None:
+            for kind in ("user", "content", "similar"):
+                try:
+                    await self.config.guild(guild).clear_raw(self.rule_name, f"{kind}_limit")
+                except KeyError:
+                    pass
+        else:
+            try:
+                await self.config.guild(guild).clear_raw(self.rule_name, "channel_limits", str(channel.id))
+            except KeyError:
+                pass
+        await self.plans.invalidate(guild, self.rule_name)
+
+    async def set_collect_window(self, guild: discord.Guild, seconds: int,) -> None:
+        """Sets how long spammers are collected for after a raid starts"""
+        await self.config.guild(guild).set_raw(
+            self.rule_name, "collect_window", value=seconds,
+        )
+        await self.plans.invalidate(guild, self.rule_name)
+
+    def write_spammers_file(self, path: str, list_of_ids) -> None:
+        """Blocking, run it in an executor"""
         log.info(f"Making new file with {len(list_of_ids)} ids ")
-        with open(f"{self.data_path}/spam_users.txt", "w") as f:
+        with open(path, "w") as f:
             f.write(str(datetime.date.today()))
             f.write("\n\n")
             for id in list_of_ids:
@@ -66,25 +236,53 @@ class SpamRule(BaseRule):
             f.write("--" * 10)
             f.write(f"\n{len(list_of_ids)} total users.")
 
-    async def finish_collecting(self, message):
-        if not self.is_sleeping:
-            channel = await self.config.guild(message.guild).get_raw("settings", "announcement_channel")
-            channel = self.bot.get_channel(channel)
-            self.is_sleeping = True
-            await asyncio.sleep(300) # wait 5 minutes before we send the file to allow the cacheing to catch up
-            await self.make_nice_file(set(self.user_cache))
-            log.info('Attempting to send recent spammers in last five minutes')
-            log.info(f'File Path: {self.data_path}/spam_users.txt')
-            await channel.send("ID's found during most recent spamrule encounter:",
-                               file=discord.File(f"{self.data_path}/spam_users.txt"))
-
-    async def is_offensive(self, message: discord.Message,) -> bool:
+    async def send_collected(self, guild_id: int, spammers: set) -> None:
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or not spammers:
+            return
+
+        plan = await self.plans.get(guild)
+        channel = guild.get_channel(plan.announcement_channel) if plan.announcement_channel else None
+        if channel is None:
+            log.info(f"Collected {len(spammers)} spammers in {guild} but no announcement channel is set")
+            return
+
+        path = f"{self.data_path}/spam_users_{guild_id}.txt"
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.write_spammers_file, path, spammers
+        )
+        log.info("Attempting to send recent spammers")
+        log.info(f"File Path: {path}")
+        await channel.send(
+            "ID's found during most recent spamrule encounter:", file=discord.File(path),
+        )
+
+    def stats(self) -> dict:
+        """Tracked keys and evictions summed over every guild"""
+        totals = {"guilds": len(self._spam_check), "size": 0, "expirations": 0, "evictions": 0}
+        for checker in self._spam_check.values():
+            for store_stats in checker.stats():
+                for key in ("size", "expirations", "evictions"):
+                    totals[key] += store_stats[key]
+        return totals
+
+    def cancel_collectors(self) -> None:
+        for collector in self._collectors.values():
+            collector.cancel()
+        self._collectors.clear()
+
+    async def is_offensive(
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
+    ) -> bool:
         checker = self._spam_check[message.guild.id]
-        if not checker.is_spamming(message):
+        if not checker.is_spamming(message, plan, analysis):
             return False
 
-        if message.author.id not in self.user_cache:
-            self.user_cache.append(message.author.id)
-        await self.finish_collecting(message)
+        collector = self._collectors.get(message.guild.id)
+        if collector is None:
+            collector = self._collectors[message.guild.id] = RaidCollector(
+                message.guild.id, self.send_collected
+            )
+        collector.add(message.author.id, plan.options["collect_window"])
 
         return True
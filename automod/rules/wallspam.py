@@ -1,13 +1,18 @@
 import discord
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..plan import RulePlan
 
 
 class WallSpamRule(BaseRule):
+    cost = 5
+    is_memoized = True
+
     async def is_offensive(
-        self, message,
+        self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis,
     ):
         try:
-            message_split = message.content.split()
+            message_split = analysis.tokens
             is_wall_text = sum((item.count(message_split[0]) for item in message_split)) > 25
             is_maybe_wall_text = len(message_split[0]) > 800
 
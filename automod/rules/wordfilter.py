@@ -1,21 +1,126 @@
+from collections import defaultdict, namedtuple, OrderedDict
+import asyncio
+import threading
+
 import discord
 from .base import BaseRule
-import re
+from ..analysis import MessageAnalysis
+from ..matching import AhoCorasick, FuzzyIndex
+from ..normalize import normalize
+from ..patterns import CombinedPattern, PatternTimeout, validate_pattern
+from ..plan import RulePlan
 
 from ..utils import *
 import logging
 
 log = logging.getLogger("red.breadcogs.automod")
 
+FilterMatchers = namedtuple("FilterMatchers", "matcher cleaned_matcher fuzzy pattern")
+
+MAX_FUZZY_DISTANCE = 2
+
+# words held in compiled matchers that no current build asked for, the least recently used go first
+MAX_CACHED_WORDS = 200_000
+
 
 class WordFilterRule(BaseRule):
-    def __init__(self, config):
-        super().__init__(config)
+    cost = 25
+    is_memoized = True
+
+    def __init__(self, config, plans):
+        super().__init__(config, plans)
         self.name = "filterword"
+        # word keys of a set of words -> FilterMatchers, shared by guilds and plan rebuilds
+        self._matchers = OrderedDict()
+        self._cached_words = 0
+        # builds run on worker threads
+        self._matchers_lock = threading.Lock()
+        self.matcher_hits = 0
+        self.matcher_compiles = 0
+        self.pattern_timeouts = 0
+
+    @staticmethod
+    def word_key(word: dict) -> tuple:
+        """Everything about a word that changes its compiled matchers, channels only decide where it goes"""
+        return word["word"], word["is_cleaned"], word.get("is_regex", False), word.get("fuzzy", 0)
+
+    @staticmethod
+    def compile_matchers(words: [dict]) -> FilterMatchers:
+        patterns = [w["word"] for w in words if w.get("is_regex")]
+        words = [w for w in words if not w.get("is_regex")]
+        return FilterMatchers(
+            matcher=AhoCorasick(w["word"] for w in words if not w["is_cleaned"]),
+            cleaned_matcher=AhoCorasick(normalize(w["word"]) for w in words if w["is_cleaned"]),
+            fuzzy=FuzzyIndex((normalize(w["word"]), w.get("fuzzy", 0)) for w in words),
+            pattern=CombinedPattern(patterns),
+        )
+
+    def matchers_for(self, words: [dict]) -> FilterMatchers:
+        """Compiled matchers of words, only compiled when this exact set of words wasn't seen before"""
+        key = tuple(self.word_key(w) for w in words)
+        with self._matchers_lock:
+            matchers = self._matchers.get(key)
+            if matchers is not None:
+                self._matchers.move_to_end(key)
+                self.matcher_hits += 1
+                return matchers
+
+        matchers = self.compile_matchers(words)
+        with self._matchers_lock:
+            if key not in self._matchers:
+                self._matchers[key] = matchers
+                self._cached_words += len(key)
+                self.matcher_compiles += 1
+            # the set just built always stays
+            while self._cached_words > MAX_CACHED_WORDS and len(self._matchers) > 1:
+                evicted, _ = self._matchers.popitem(last=False)
+                self._cached_words -= len(evicted)
+        return matchers
+
+    async def compile_options(self, data: dict) -> dict:
+        """`build_options` on a worker thread, indexing a long word list would stall the event loop"""
+        if not data.get(self.rule_name, {}).get("words"):
+            return self.build_options(data)
+        return await asyncio.get_running_loop().run_in_executor(None, self.build_options, data)
+
+    def build_options(self, data: dict) -> dict:
+        """
+        Builds the word index, words without channels go into the global matchers and every
+        scoped word goes into the matchers of each channel it applies to.
+        Channel groups are resolved here so words added to a group follow the group.
+        Matchers of a set of words that did not change since the last build are reused.
+        """
+        words = tuple(data.get(self.rule_name, {}).get("words") or ())
+        channel_groups = data.get("settings", {}).get("channel_groups", {})
+
+        global_words = []
+        channel_words = defaultdict(list)
+        for word in words:
+            channels = set(word["channel"])
+            for group in word.get("groups", []):
+                channels.update(channel_groups.get(group, []))
+
+            if not channels:
+                global_words.append(word)
+            for channel in channels:
+                channel_words[channel].append(word)
+
+        return {
+            "words": words,
+            "global": self.matchers_for(global_words),
+            "channels": {ch: self.matchers_for(w) for ch, w in channel_words.items()},
+        }
 
     async def add_to_filter(
         self,
-        guild: discord.Guild, word: str, author: discord.Member, channels: [discord.TextChannel] = None, is_cleaned: bool = False,
+        guild: discord.Guild,
+        word: str,
+        author: discord.Member,
+        channels: [discord.TextChannel] = None,
+        is_cleaned: bool = False,
+        group: str = None,
+        fuzzy: int = 0,
+        is_regex: bool = False,
     ) -> None:
         """
         Add a word to the filter list
@@ -31,7 +136,16 @@ class WordFilterRule(BaseRule):
             The channel where to filter
 
         is_cleaned: bool
-            If True all punctuation will be removed from the words being checked. This defaults to False
+            If True the message is normalized before checking, see `normalize.normalize`. This defaults to False
+
+        group: str, Optional
+            The channel group the word was added to, the word follows the group's channels
+
+        fuzzy: int
+            How many typos (0 to 2) a word in the message may have and still be filtered. This defaults to 0
+
+        is_regex: bool
+            If True `word` is a regular expression, it is validated before being saved. This defaults to False
 
         guild: discord.Guild
             The guild where the filtered word applies
@@ -39,21 +153,32 @@ class WordFilterRule(BaseRule):
         Returns
         -------
         None
+
+        Raises
+        -------
+            RiskyPatternError if `word` is a regular expression that is invalid or could backtrack badly
         """
+        if is_regex:
+            validate_pattern(word)
+
         to_append = {
             "word": word,
             "author": author.id,
             "is_cleaned": is_cleaned,
-            "channel": [channel.id for channel in channels] if channels else []
+            "channel": [channel.id for channel in channels] if channels else [],
+            "groups": [group.lower()] if group else [],
+            "fuzzy": fuzzy,
+            "is_regex": is_regex,
         }
         try:
             words = await self.config.guild(guild).get_raw(self.rule_name, "words")
             words.append(to_append)
             await self.config.guild(guild).set_raw(self.rule_name, "words", value=words)
         except KeyError:
-            return await self.config.guild(guild).set_raw(
+            await self.config.guild(guild).set_raw(
                 self.rule_name, "words", value=[to_append]
             )
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def remove_filter(self, guild: discord.Guild, word: str) -> None:
         """
@@ -73,11 +198,10 @@ class WordFilterRule(BaseRule):
             ValueError if word is not found
         """
         all_words = await self.get_filtered_words(guild)
-        for index, word_dict in enumerate(all_words):
-            if word.lower() == word_dict['word']:
-                all_words.pop(index)
+        all_words = [w for w in all_words if w['word'] not in (word, word.lower())]
 
         await self.config.guild(guild).set_raw(self.rule_name, "words", value=all_words)
+        await self.plans.invalidate(guild, self.rule_name)
 
     async def get_filtered_words(self, guild: discord.Guild) -> [dict]:
         """
@@ -97,35 +221,66 @@ class WordFilterRule(BaseRule):
         except KeyError:
             return []
 
-    @staticmethod
-    def remove_punctuation(sentence: str):
-        from string import punctuation
-        no_punc = sentence.translate(str.maketrans('', '', punctuation))
-        return no_punc
+    async def is_filtered(
+        self,
+        analysis: MessageAnalysis,
+        matcher: AhoCorasick,
+        cleaned_matcher: AhoCorasick,
+        fuzzy: FuzzyIndex,
+        pattern: CombinedPattern,
+    ):
+        """
+        Checks the message against the compiled filters
+        Parameters
+        ----------
+        analysis: MessageAnalysis
+            The message being checked
+        matcher: AhoCorasick
+            Words matched against the message as is
+        cleaned_matcher: AhoCorasick
+            Normalized words matched against the normalized message
+        fuzzy: FuzzyIndex
+            Words allowing typos, looked up with each normalized word of the message
+        pattern: CombinedPattern
+            Regex filters, checked last as they run on a worker thread
 
-    @staticmethod
-    def no_mentions(sentence: str):
-        mentionless = re.sub(r"<@!?(\d+)>", "", sentence)
-        return mentionless
+        Returns
+        -------
+        bool
 
-    async def is_filtered(self, sentence: str, filtered_words: [dict]):
-        for word in filtered_words:
-            to_filter = word['word']
-            is_cleaned = word['is_cleaned']
+        Raises
+        -------
+            PatternTimeout when nothing else matched and the regex filters ran out of time
+        """
+        if matcher and matcher.search(analysis.without_mentions) is not None:
+            return True
 
-            if is_cleaned:
-                sentence = self.remove_punctuation(sentence)
+        if cleaned_matcher and cleaned_matcher.search(analysis.normalized) is not None:
+            return True
 
-            if to_filter in sentence:
-                return True
+        if fuzzy and fuzzy.search(analysis.normalized_tokens) is not None:
+            return True
+
+        if pattern and await pattern.search(analysis.without_mentions) is not None:
+            return True
 
         return False
 
-    async def is_offensive(self, message: discord.Message):
-        all_words = await self.get_filtered_words(message.guild)
-        sentence = self.no_mentions(message.content)
+    def is_channel_scoped(self, plan: RulePlan, channel_id: int) -> bool:
+        return channel_id in plan.options["channels"]
 
-        for word in all_words:
-            channels = word['channel']
-            if message.channel.id in channels or channels is None:
-                return await self.is_filtered(sentence, all_words)
+    async def is_offensive(self, message: discord.Message, plan: RulePlan, analysis: MessageAnalysis):
+        """Raises PatternTimeout when no filter matched but a regex filter could not finish"""
+        timed_out = None
+        for matchers in (plan.options["global"], plan.options["channels"].get(message.channel.id)):
+            if matchers is None:
+                continue
+            try:
+                if await self.is_filtered(analysis, *matchers):
+                    return True
+            except PatternTimeout as e:
+                self.pattern_timeouts += 1
+                timed_out = e
+        if timed_out is not None:
+            raise timed_out
+        return False
@@ -0,0 +1,68 @@
+"""
+Decides the order rules are evaluated in.
+
+Rules whose action is more severe go first so a ban can skip most of the rest, within the same
+severity the cheapest rule goes first. Costs start from each rule's declared `cost` and follow
+the measured time of `is_offensive` once the rule has run.
+"""
+import logging
+
+from .actions import SEVERITY
+from .plan import GuildRulePlan
+
+log = logging.getLogger("red.breadcogs.automod.scheduling")
+
+# nothing can outrank this action, once a rule decides it only rules that keep state or purge still run
+TERMINAL_ACTION = "ban"
+
+
+class RuleScheduler:
+    # measurements between two checks of whether the ranking changed
+    RERANK_EVERY = 1000
+    # weight of a new measurement in the moving average
+    ALPHA = 0.05
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # rule name -> average seconds per evaluation
+        self.costs = {rule.rule_name: rule.cost / 1e6 for rule in self.rules}
+        self._ranking = self._rank()
+        self._measured = 0
+        self._generation = 0
+        # guild id -> (plan version, generation, ordered rules)
+        self._orders = {}
+
+    def _rank(self) -> tuple:
+        return tuple(sorted(self.costs, key=self.costs.get))
+
+    def stats(self) -> dict:
+        return {rule_name: self.costs[rule_name] for rule_name in self._ranking}
+
+    def order(self, plan: GuildRulePlan) -> list:
+        cached = self._orders.get(plan.guild_id)
+        if cached is not None and cached[0] == plan.version and cached[1] == self._generation:
+            return cached[2]
+
+        position = {rule_name: i for i, rule_name in enumerate(self._ranking)}
+        order = sorted(
+            self.rules,
+            key=lambda rule: (
+                -SEVERITY.get(plan.get_rule(rule.rule_name).action_to_take, 0),
+                position[rule.rule_name],
+            ),
+        )
+        self._orders[plan.guild_id] = (plan.version, self._generation, order)
+        return order
+
+    def record(self, rule_name: str, seconds: float) -> None:
+        self.costs[rule_name] += (seconds - self.costs[rule_name]) * self.ALPHA
+        self._measured += 1
+        if self._measured < self.RERANK_EVERY:
+            return
+
+        self._measured = 0
+        ranking = self._rank()
+        if ranking != self._ranking:
+            log.debug(f"Rule order changed to {ranking}")
+            self._ranking = ranking
+            self._generation += 1
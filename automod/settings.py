@@ -1,4 +1,6 @@
 import asyncio
+import time
+from datetime import datetime
 from typing import Optional, Union
 
 import discord
@@ -9,7 +11,10 @@ import logging
 from redbot.core.utils.chat_formatting import box
 
 from .rules.base import BaseRuleSettingsDisplay
-from .utils import transform_bool, error_message, docstring_parameter
+from .raid import AGE_BUCKETS, AGE_LABELS
+from .recent import MAX_RECENT_DEPTH
+from .strikes import ESCALATION
+from .utils import transform_bool, error_message, docstring_parameter, check_success
 from .converters import ToggleBool
 
 log = logging.getLogger(name="red.breadcogs.automod")
@@ -20,6 +25,7 @@ class Settings:
         self.bot = kwargs.get("bot")
         self.config = kwargs.get("config")
         self.rules_map = kwargs.get("rules_map")
+        self.plans = kwargs.get("plans")
 
     async def set_announcement_channel(
         self, guild: discord.Guild, channel: discord.TextChannel
@@ -35,6 +41,7 @@ class Settings:
         await self.config.guild(guild).set_raw(
             "settings", "announcement_channel", value=channel.id
         )
+        await self.plans.invalidate(guild)
 
         return before_channel, channel
 
@@ -57,9 +64,18 @@ class Settings:
             pass
 
         await self.config.guild(guild).set_raw("settings", "is_announcement_enabled", value=toggle)
+        await self.plans.invalidate(guild)
 
         return before, toggle
 
+    async def set_digest_window(self, guild: discord.Guild, seconds: int) -> None:
+        await self.config.guild(guild).set_raw("settings", "digest_window", value=seconds)
+        await self.plans.invalidate(guild)
+
+    async def set_recent_depth(self, guild: discord.Guild, depth: int) -> None:
+        await self.config.guild(guild).set_raw("settings", "recent_depth", value=depth)
+        await self.plans.invalidate(guild)
+
     async def get_all_settings(self, guild: discord.Guild) -> [discord.Embed]:
         settings = []
         for rule_name, rule in self.rules_map.items():
@@ -147,6 +163,18 @@ class Settings:
         )
         if announcing:
             embed.add_field(name="Channel", value=box(where, "diff"))
+
+        # the raid plan deletes with every rule, that is no requirement outside of raids
+        plan = await self.plans.get(guild, raid=False)
+        missing = self.permissions.missing(guild, plan.rules.values())
+        if missing:
+            value = "\n".join(
+                f"- {permission.replace('_', ' ').title()} (needed by {', '.join(rules)})"
+                for permission, rules in missing.items()
+            )
+        else:
+            value = "+ All permissions the rules need are present"
+        embed.add_field(name="Permissions", value=box(value, "diff"), inline=False)
         return [embed]
 
     async def get_rule_settings_as_embed(self, guild, rule_name):
@@ -197,6 +225,17 @@ class Settings:
 
         all_groups[group_name.lower()] = [ch.id for ch in channels]
         await self.config.guild(guild).set_raw("settings", "channel_groups", value=all_groups)
+        await self.plans.invalidate(guild)
+
+    async def set_raid_setting(self, guild: discord.Guild, key: str, value) -> None:
+        """Writes one of the join raid detection settings, see `DEFAULT_RAID_SETTINGS`"""
+        await self.config.guild(guild).set_raw("settings", "raid", key, value=value)
+        await self.plans.invalidate(guild)
+
+    async def set_strike_setting(self, guild: discord.Guild, *keys, value) -> None:
+        """Writes one of the strike settings, see `DEFAULT_STRIKE_SETTINGS`"""
+        await self.config.guild(guild).set_raw("settings", "strikes", *keys, value=value)
+        await self.plans.invalidate(guild)
 
     @commands.group()
     @checks.mod_or_permissions(manage_messages=True)
@@ -260,6 +299,355 @@ class Settings:
             embed = await self.get_rule_settings_as_embed(ctx.guild, rulename)
             await ctx.send(embed=embed[0])
 
+    @automodset.command(name="stats")
+    @checks.is_owner()
+    async def show_stats(self, ctx):
+        """
+        Show internal cache statistics
+        """
+        plan_stats = self.plans.stats()
+        spam_stats = self.spamrule.stats()
+        delete_stats = self.deletes.stats()
+        announce_stats = self.announcements.stats()
+        member_stats = self.members.stats()
+        history_stats = self.history.stats()
+        recent_stats = self.recent.stats()
+        strike_stats = self.strikes.stats()
+        rule_costs = "".join(
+            f"{rule_name:<16}: {seconds * 1e6:.1f}µs\n" for rule_name, seconds in self.scheduler.stats().items()
+        )
+        verdict_stats = self.verdicts.stats()
+        verdict_rates = "".join(
+            f"{rule_name:<16}: {hits / (hits + misses):.0%} of [{hits + misses}]\n" if hits + misses
+            else f"{rule_name:<16}: -\n"
+            for rule_name, (hits, misses) in verdict_stats["rules"].items()
+        )
+        executor_stats = self.executor.stats()
+        lanes = "".join(
+            f"{name.title():<12}: [{lane['depth']}] waiting, {lane['wait_avg'] * 1000:.0f}ms avg, "
+            f"{lane['wait_max'] * 1000:.0f}ms max\n"
+            for name, lane in executor_stats["lanes"].items()
+        )
+        await ctx.send(
+            box(
+                f"Rule plans\n"
+                f"----------\n"
+                f"Cached      : [{plan_stats['size']}/{plan_stats['max_size']}]\n"
+                f"Hits        : [{plan_stats['hits']}]\n"
+                f"Misses      : [{plan_stats['misses']}]\n"
+                f"Evictions   : [{plan_stats['evictions']}]\n"
+                f"Raided      : [{plan_stats['raids']}]\n"
+                f"Word lists  : [{self.wordfilterrule.matcher_compiles}] compiled, "
+                f"[{self.wordfilterrule.matcher_hits}] reused\n"
+                f"Regex       : [{self.wordfilterrule.pattern_timeouts}] searches timed out\n"
+                f"\n"
+                f"Members\n"
+                f"-------\n"
+                f"Cached      : [{member_stats['size']}/{member_stats['max_size']}]\n"
+                f"Hits        : [{member_stats['hits']}]\n"
+                f"Misses      : [{member_stats['misses']}]\n"
+                f"\n"
+                f"Rule cost, in evaluation order\n"
+                f"------------------------------\n"
+                f"{rule_costs}"
+                f"\n"
+                f"Verdict memo\n"
+                f"------------\n"
+                f"Cached      : [{verdict_stats['size']}/{verdict_stats['max_size']}]\n"
+                f"Evictions   : [{verdict_stats['evictions']}]\n"
+                f"{verdict_rates}"
+                f"\n"
+                f"Spam counters\n"
+                f"-------------\n"
+                f"Guilds      : [{spam_stats['guilds']}]\n"
+                f"Tracked     : [{spam_stats['size']}]\n"
+                f"Expirations : [{spam_stats['expirations']}]\n"
+                f"Evictions   : [{spam_stats['evictions']}]\n"
+                f"\n"
+                f"Deletes\n"
+                f"-------\n"
+                f"Requested   : [{delete_stats['requested']}]\n"
+                f"API calls   : [{delete_stats['api_calls']}]\n"
+                f"Saved       : [{delete_stats['saved']}]\n"
+                f"Pending     : [{delete_stats['pending']}]\n"
+                f"Skipped     : [{self.permissions.skipped}] requests without permission\n"
+                f"Purges      : [{recent_stats['purges']}] found [{recent_stats['purged']}] messages\n"
+                f"Tracked     : [{recent_stats['channels']}] channels, [{recent_stats['slots']}] slots\n"
+                f"\n"
+                f"History\n"
+                f"-------\n"
+                f"Queued      : [{history_stats['queued']}]\n"
+                f"Written     : [{history_stats['written']}]\n"
+                f"Dropped     : [{history_stats['dropped']}]\n"
+                f"\n"
+                f"Strikes\n"
+                f"-------\n"
+                f"Tracked     : [{strike_stats['tracked']}] members in [{strike_stats['guilds']}] guilds\n"
+                f"Unsaved     : [{strike_stats['dirty']}] guilds\n"
+                f"Writes      : [{strike_stats['writes']}]\n"
+                f"\n"
+                f"Announcements\n"
+                f"-------------\n"
+                f"Infractions : [{announce_stats['received']}]\n"
+                f"Messages    : [{announce_stats['sent']}]\n"
+                f"Pending     : [{announce_stats['pending']}]\n"
+                f"\n"
+                f"Action queue\n"
+                f"------------\n"
+                f"Queued      : [{executor_stats['size']}/{executor_stats['max_size']}]\n"
+                f"Guilds      : [{executor_stats['guilds']}]\n"
+                f"Processed   : [{executor_stats['processed']}]\n"
+                f"Failed      : [{executor_stats['failed']}]\n"
+                f"Dropped     : [{executor_stats['dropped']}]\n"
+                f"{lanes}",
+                "ini",
+            )
+        )
+
+    @automodset.group(name="raid")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def raid(self, ctx):
+        """
+        Join raid detection
+
+        When too many members, or too many new accounts, join in a short time the server
+        enters a raid state. Spam and mention limits are halved and every enabled rule deletes
+        offending messages until the raid state ends.
+        """
+        pass
+
+    @raid.command(name="toggle")
+    @docstring_parameter(ToggleBool.fmt_box)
+    async def _raid_toggle(self, ctx, toggle: ToggleBool):
+        """
+        Toggles join raid detection.
+
+        {0}
+        """
+        await self.set_raid_setting(ctx.guild, "enabled", toggle)
+        if not toggle:
+            self.raids.end(ctx.guild.id)
+        await ctx.send(f"`🚨` Join raid detection is now `{transform_bool(toggle)}`")
+
+    @raid.command(name="joins")
+    async def _raid_joins(self, ctx, joins: int, seconds: int):
+        """Set how many joins within a period start a raid"""
+        if joins < 2 or not 10 <= seconds <= 3600:
+            return await ctx.send(
+                await error_message("Use at least 2 joins over a period between 10 and 3600 seconds.")
+            )
+        await self.set_raid_setting(ctx.guild, "join_limit", [joins, seconds])
+        await ctx.send(check_success(f"A raid starts at `{joins}` joins within `{seconds}` seconds."))
+
+    @raid.command(name="young")
+    async def _raid_young(self, ctx, joins: int, age: str = "1d"):
+        """
+        Set how many new accounts joining within the join period start a raid
+
+        `age` is how old an account may be to count as new, one of `1h`, `1d`, `7d` or `30d`.
+        """
+        if age not in AGE_LABELS[:-1]:
+            return await ctx.send(await error_message("Age must be one of `1h`, `1d`, `7d` or `30d`."))
+        if joins < 1:
+            return await ctx.send(await error_message("Use at least 1 join."))
+        await self.set_raid_setting(ctx.guild, "young_limit", joins)
+        await self.set_raid_setting(ctx.guild, "young_age", AGE_BUCKETS[AGE_LABELS.index(age)])
+        await ctx.send(check_success(f"A raid starts at `{joins}` accounts younger than `{age}`."))
+
+    @raid.command(name="duration")
+    async def _raid_duration(self, ctx, seconds: int):
+        """Set how long the raid state lasts after the last suspicious join"""
+        if not 60 <= seconds <= 86400:
+            return await ctx.send(await error_message("Duration must be between 60 and 86400 seconds."))
+        await self.set_raid_setting(ctx.guild, "duration", seconds)
+        await ctx.send(check_success(f"The raid state now lasts `{seconds}` seconds."))
+
+    @raid.command(name="end", aliases=["stop"])
+    async def _raid_end(self, ctx):
+        """End the raid state now"""
+        if not self.raids.end(ctx.guild.id):
+            return await ctx.send(await error_message("The server is not in a raid state."))
+        await ctx.send(check_success("Raid state ended."))
+
+    @raid.command(name="status", aliases=["show"])
+    async def _raid_status(self, ctx):
+        """Show the raid settings and recent joins"""
+        settings = (await self.plans.get(ctx.guild)).raid_settings
+        joins, seconds = settings["join_limit"]
+        young_age = AGE_LABELS[AGE_BUCKETS.index(settings["young_age"])]
+        histogram = self.raids.histogram(ctx.guild.id)
+        ages = "\n".join(f"{label:<6}: {count}" for label, count in zip(AGE_LABELS, histogram))
+        await ctx.send(
+            box(
+                f"Enabled   : [{settings['enabled']}]\n"
+                f"Raided    : [{self.raids.is_raid(ctx.guild.id)}]\n"
+                f"Joins     : {joins} within {seconds}s\n"
+                f"New       : {settings['young_limit']} younger than {young_age}\n"
+                f"Duration  : {settings['duration']}s\n"
+                f"\n"
+                f"[Joins in the last {seconds}s by account age]\n"
+                f"{ages}",
+                "ini",
+            )
+        )
+
+    @automodset.group(name="purge")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def purge_settings(self, ctx):
+        """
+        Settings for purging offenders' recent messages
+
+        Turn purging on per rule with `[p]<rule> purge <minutes>`.
+        """
+        pass
+
+    @purge_settings.command(name="depth")
+    async def _purge_depth(self, ctx, messages: int):
+        """
+        Set how many of the latest messages of every channel are remembered for purging.
+
+        Messages further back than this are not purged, however recent they are.
+        """
+        if not 1 <= messages <= MAX_RECENT_DEPTH:
+            return await ctx.send(
+                await error_message(f"The depth must be between 1 and {MAX_RECENT_DEPTH} messages.")
+            )
+        await self.set_recent_depth(ctx.guild, messages)
+        await ctx.send(check_success(f"The latest `{messages}` messages of every channel are remembered for purging."))
+
+    @automodset.group(name="history")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def history_settings(self, ctx):
+        """
+        Look through past infractions
+        """
+        pass
+
+    @history_settings.command(name="user", aliases=["member"])
+    async def _history_user(self, ctx, user: discord.User, limit: int = 10):
+        """Show the latest infractions of a user"""
+        limit = max(1, min(limit, 25))
+        rows = await self.history.user_history(ctx.guild.id, user.id, limit)
+        if not rows:
+            return await ctx.send(f"`📜` No infractions recorded for {user}.")
+
+        total = await self.history.user_count(ctx.guild.id, user.id)
+        lines = []
+        for created_at, rule, action, success, deleted, channel_id in rows:
+            when = datetime.utcfromtimestamp(created_at).strftime("%Y-%m-%d %H:%M")
+            channel = ctx.guild.get_channel(channel_id) or channel_id
+            status = ("" if success else " (failed)") + (", deleted" if deleted else "")
+            lines.append(f"{when} #{channel} {rule}: {action}{status}")
+        await ctx.send(
+            f"`📜` Latest {len(rows)} of {total} infractions recorded for {user}"
+            + box("\n".join(lines))
+        )
+
+    @history_settings.command(name="rules")
+    async def _history_rules(self, ctx, days: int = 7):
+        """Show how often each rule was broken in the last days"""
+        days = max(1, min(days, 365))
+        since = int(time.time()) - days * 86400
+        rule_names = [rule.rule_name for rule in self.rules_map.values()]
+        counts = await self.history.rule_counts(ctx.guild.id, rule_names, since)
+        total = sum(counts.values())
+        lines = [
+            f"{rule_name:<18}: {count:>7} ({count / total:.0%}, {count / days:.1f}/day)" if total else f"{rule_name:<18}: 0"
+            for rule_name, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        ]
+        await ctx.send(f"`📜` Rule hits in the last {days} days" + box("\n".join(lines)))
+
+    @automodset.group(name="strikes", aliases=["strike"])
+    @checks.mod_or_permissions(manage_messages=True)
+    async def strikes_settings(self, ctx):
+        """
+        Escalating strikes
+
+        Every infraction adds a strike to the member, strikes wear off over time.
+        Once enough strikes add up the action taken is raised to deleting the message,
+        adding a role, kicking and finally banning, whatever the rule itself would do.
+        """
+        pass
+
+    @strikes_settings.command(name="toggle")
+    @docstring_parameter(ToggleBool.fmt_box)
+    async def _strikes_toggle(self, ctx, toggle: ToggleBool):
+        """
+        Toggles escalating strikes.
+
+        {0}
+        """
+        await self.set_strike_setting(ctx.guild, "enabled", value=toggle)
+        await ctx.send(f"`⚖` Escalating strikes are now `{transform_bool(toggle)}`")
+
+    @strikes_settings.command(name="threshold")
+    async def _strikes_threshold(self, ctx, step: str, strikes: float):
+        """
+        Set the strikes a member needs for a step
+
+        `step` is one of `delete`, `add_role`, `kick` or `ban`. Use 0 strikes to skip the step.
+        """
+        steps = ("delete",) + ESCALATION
+        if step not in steps:
+            return await ctx.send(
+                await error_message(f"Step must be one of {', '.join(f'`{s}`' for s in steps)}.")
+            )
+        if strikes < 0:
+            return await ctx.send(await error_message("Strikes can't be negative."))
+        await self.set_strike_setting(ctx.guild, "thresholds", step, value=strikes)
+        if not strikes:
+            return await ctx.send(check_success(f"`{step}` is no longer an escalation step."))
+        await ctx.send(check_success(f"Members with `{strikes:g}` strikes now get `{step}`."))
+
+    @strikes_settings.command(name="halflife")
+    async def _strikes_half_life(self, ctx, minutes: int):
+        """Set how many minutes it takes for half of a member's strikes to wear off"""
+        if not 1 <= minutes <= 60 * 24 * 30:
+            return await ctx.send(await error_message("Half life must be between 1 minute and 30 days."))
+        await self.set_strike_setting(ctx.guild, "half_life", value=minutes * 60)
+        await ctx.send(check_success(f"Strikes now halve every `{minutes}` minutes."))
+
+    @strikes_settings.command(name="role")
+    async def _strikes_role(self, ctx, role: discord.Role = None):
+        """Set the role added at the `add_role` step, without a role the rule's own role is used"""
+        await self.set_strike_setting(ctx.guild, "role", value=role.id if role else None)
+        if role is None:
+            return await ctx.send(check_success("The `add_role` step now uses the role of the rule."))
+        await ctx.send(check_success(f"The `add_role` step now adds `{role}`."))
+
+    @strikes_settings.command(name="show")
+    async def _strikes_show(self, ctx, member: discord.Member = None):
+        """Show the strike settings, or the strikes of a member"""
+        settings = (await self.plans.get(ctx.guild)).strike_settings
+        if member is not None:
+            await self.strikes.load(ctx.guild)
+            score = self.strikes.score(ctx.guild.id, member.id, settings["half_life"])
+            return await ctx.send(f"`⚖` {member} has `{score:.2f}` strikes.")
+
+        steps = "\n".join(
+            f"{step:<9}: {threshold:g}" if threshold else f"{step:<9}: off"
+            for step, threshold in settings["thresholds"].items()
+        )
+        role = ctx.guild.get_role(settings["role"]) if settings["role"] else None
+        await ctx.send(
+            box(
+                f"Enabled   : [{settings['enabled']}]\n"
+                f"Half life : {settings['half_life'] // 60} minutes\n"
+                f"Role      : {role or 'role of the rule'}\n"
+                f"\n"
+                f"[Strikes needed]\n"
+                f"{steps}",
+                "ini",
+            )
+        )
+
+    @strikes_settings.command(name="clear")
+    async def _strikes_clear(self, ctx, member: discord.Member):
+        """Forgive all strikes of a member"""
+        await self.strikes.load(ctx.guild)
+        self.strikes.clear(ctx.guild.id, member.id)
+        await ctx.send(check_success(f"Cleared the strikes of {member}."))
+
     @automodset.group()
     @checks.mod_or_permissions(manage_messages=True)
     async def announce(self, ctx):
@@ -303,3 +691,19 @@ class Settings:
             f"{ctx.author} ({ctx.author.id}) changed announcement channel from {before} to {after}"
         )
         await ctx.send(f"`🔔` Announcement channel changed from `{before}` to `{after}`")
+
+    @announce.command(name="digest")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _digest(self, ctx, seconds: int):
+        """
+        Set how long infractions are collected into one digest message.
+
+        The first infraction after a quiet period is announced right away, the ones following it
+        within this many seconds are summed up in a single message. Use 0 to announce every infraction.
+        """
+        if not 0 <= seconds <= 300:
+            return await ctx.send(await error_message("The digest window must be between 0 and 300 seconds."))
+        await self.set_digest_window(ctx.guild, seconds)
+        if not seconds:
+            return await ctx.send(check_success("Every infraction will be announced on its own."))
+        await ctx.send(f"`🔔` Infractions within `{seconds}` seconds are now announced as one digest.")
@@ -0,0 +1,109 @@
+"""
+Near duplicate detection for spam that changes a few characters or hops between channels.
+
+Messages are reduced to a small MinHash signature and indexed with locality sensitive
+hashing, so finding similar recent messages only looks at a handful of buckets.
+"""
+from collections import OrderedDict
+from typing import Iterable
+import itertools
+import random
+
+_MASK = (1 << 61) - 1
+
+# messages shorter than this are too generic to call near duplicates, `gm` or `lol`
+MIN_LENGTH = 20
+
+
+def shingles(tokens: [str], text: str) -> {int}:
+    """Hashed word pairs, or character 4-grams for messages of very few words"""
+    if len(tokens) >= 3:
+        return {hash(pair) & _MASK for pair in zip(tokens, tokens[1:])}
+    return {hash(text[i : i + 4]) & _MASK for i in range(max(len(text) - 3, 1))}
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures with `bands * rows` hash functions.
+
+    The shingles are already well mixed hashes, so each hash function is an xor with a random
+    mask instead of a full `(a * h + b) % p` permutation, which is more than twice as fast.
+    """
+
+    __slots__ = ("bands", "rows", "_masks")
+
+    def __init__(self, bands: int = 4, rows: int = 3, seed: int = 6607):
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(61) for _ in range(bands * rows)]
+
+    def signature(self, hashes: Iterable[int]) -> tuple:
+        hashes = list(hashes)
+        return tuple([min(map(mask.__xor__, hashes)) for mask in self._masks])
+
+    def band_keys(self, signature: tuple) -> [tuple]:
+        rows = self.rows
+        return [(band, signature[band * rows : (band + 1) * rows]) for band in range(self.bands)]
+
+
+class NearDuplicateIndex:
+    """
+    Short lived LSH index of recent message signatures for one guild.
+
+    Two messages land in the same bucket when one of their bands is identical, with 4 bands
+    of 3 rows that is likely from roughly 60% similarity upwards. Candidates are then confirmed
+    by the share of signature values they agree on.
+    """
+
+    __slots__ = ("hasher", "window", "threshold", "max_entries", "_entries", "_buckets", "_ids")
+
+    def __init__(self, hasher: MinHasher, window: float, threshold: float = 0.6, max_entries: int = 5_000):
+        self.hasher = hasher
+        self.window = window
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # entry id -> (timestamp, signature, band keys), oldest first
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop_oldest(self) -> None:
+        entry_id, (_, _, keys) = self._entries.popitem(last=False)
+        for key in keys:
+            bucket = self._buckets[key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def prune(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._entries and next(iter(self._entries.values()))[0] < cutoff:
+            self._drop_oldest()
+
+    def add(self, signature: tuple, now: float) -> int:
+        """Indexes a signature and returns how many indexed messages, itself included, are similar"""
+        self.prune(now)
+        keys = self.hasher.band_keys(signature)
+
+        candidates = set()
+        for key in keys:
+            candidates.update(self._buckets.get(key, ()))
+
+        needed = self.threshold * len(signature)
+        similar = 1
+        for entry_id in candidates:
+            other = self._entries[entry_id][1]
+            if sum(1 for a, b in zip(signature, other) if a == b) >= needed:
+                similar += 1
+
+        if len(self._entries) >= self.max_entries:
+            self._drop_oldest()
+        entry_id = next(self._ids)
+        self._entries[entry_id] = (now, signature, keys)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(entry_id)
+        return similar
@@ -0,0 +1,151 @@
+"""
+Strike scores that escalate the action taken against repeat offenders.
+
+Every infraction adds a strike to the author's score in that guild, the score halves every
+`half_life` seconds. Scores live in memory and dirty guilds are written to config in one
+batch every `FLUSH_INTERVAL` seconds, never on the action path.
+"""
+from dataclasses import replace
+from typing import Mapping
+import asyncio
+import logging
+import time
+
+import discord
+
+from .actions import ActionPlan
+
+log = logging.getLogger("red.breadcogs.automod.strikes")
+
+# escalation steps past deleting, least to most severe
+ESCALATION = ("add_role", "kick", "ban")
+# scores below this have decayed away and are dropped
+FORGET_BELOW = 0.05
+# strikes given moments apart have decayed a hair, that must not miss a threshold
+TOLERANCE = 0.01
+
+
+class Strike:
+    __slots__ = ("score", "updated")
+
+    def __init__(self, score: float, updated: float):
+        self.score = score
+        self.updated = updated
+
+    def decayed(self, now: float, half_life: float) -> float:
+        return self.score * 0.5 ** ((now - self.updated) / half_life)
+
+
+class StrikeBook:
+    FLUSH_INTERVAL = 60
+
+    def __init__(self, config):
+        self.config = config
+        # guild id -> {member id: Strike}
+        self._guilds = {}
+        # guild id -> half life last used, to prune decayed scores when saving
+        self._half_lives = {}
+        self._dirty = set()
+        self._task = None
+        self.writes = 0
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self._guilds),
+            "tracked": sum(len(strikes) for strikes in self._guilds.values()),
+            "dirty": len(self._dirty),
+            "writes": self.writes,
+        }
+
+    async def load(self, guild: discord.Guild) -> None:
+        """Reads the saved scores of guild once"""
+        if guild.id in self._guilds:
+            return
+        try:
+            saved = await self.config.guild(guild).get_raw("member_strikes")
+        except KeyError:
+            saved = {}
+        # another message of the guild may have loaded it while we waited
+        if guild.id not in self._guilds:
+            self._guilds[guild.id] = {
+                int(member_id): Strike(score, updated) for member_id, (score, updated) in saved.items()
+            }
+
+    def score(self, guild_id: int, member_id: int, half_life: float) -> float:
+        strike = self._guilds.get(guild_id, {}).get(member_id)
+        return 0.0 if strike is None else strike.decayed(time.time(), half_life)
+
+    def add(self, guild_id: int, member_id: int, half_life: float, weight: float = 1.0) -> float:
+        """Adds a strike and returns the member's new score"""
+        now = time.time()
+        strikes = self._guilds.setdefault(guild_id, {})
+        strike = strikes.get(member_id)
+        if strike is None:
+            strike = strikes[member_id] = Strike(0.0, now)
+        strike.score = strike.decayed(now, half_life) + weight
+        strike.updated = now
+
+        self._half_lives[guild_id] = half_life
+        self._dirty.add(guild_id)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+        return strike.score
+
+    def clear(self, guild_id: int, member_id: int = None) -> None:
+        strikes = self._guilds.get(guild_id)
+        if strikes is None:
+            return
+        if member_id is None:
+            strikes.clear()
+        else:
+            strikes.pop(member_id, None)
+        self._dirty.add(guild_id)
+
+    def escalate(self, actions: ActionPlan, score: float, settings: Mapping) -> ActionPlan:
+        """Raises the action of `actions` to the most severe step `score` has reached"""
+        thresholds = settings["thresholds"]
+        role = settings["role"] or actions.role_to_add
+        reached_score = score + TOLERANCE
+        reached = [
+            action
+            for action in ESCALATION
+            if thresholds.get(action) and reached_score >= thresholds[action] and (action != "add_role" or role)
+        ]
+        if reached:
+            actions = actions.escalate(reached[-1], score, role)
+        else:
+            actions = replace(actions, strikes=score)
+
+        if thresholds.get("delete") and reached_score >= thresholds["delete"] and not actions.delete_message:
+            actions = replace(actions, delete_message=True)
+        return actions
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to save strikes")
+
+    async def flush(self) -> None:
+        """Writes every guild with changed scores, one config write per guild"""
+        dirty, self._dirty = self._dirty, set()
+        now = time.time()
+        for guild_id in dirty:
+            strikes = self._guilds.get(guild_id, {})
+            half_life = self._half_lives.get(guild_id)
+            if half_life is not None:
+                for member_id in [m for m, s in strikes.items() if s.decayed(now, half_life) < FORGET_BELOW]:
+                    del strikes[member_id]
+            data = {str(member_id): [s.score, s.updated] for member_id, s in strikes.items()}
+            await self.config.guild(discord.Object(id=guild_id)).set_raw("member_strikes", value=data)
+            self.writes += 1
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._dirty:
+            # last chance to save what changed since the previous flush
+            asyncio.create_task(self.flush())
@@ -0,0 +1,41 @@
+"""
+Shows the per token cost of fuzzy word filter lookups as the filter list grows.
+
+Run from the repository root with Red installed:
+
+    python -m benchmarks.fuzzy_bench
+"""
+import random
+import string
+import timeit
+
+from automod.matching import FuzzyIndex
+
+SIZES = (100, 1_000, 10_000, 50_000)
+REPEAT = 2_000
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 10)))
+
+
+def main():
+    rng = random.Random(1)
+    tokens = [random_word(rng) for _ in range(REPEAT)]
+
+    print(f"{'words':>8} {'distance':>9} {'lookup (µs)':>12} {'build (s)':>10}")
+    for distance in (1, 2):
+        for size in SIZES:
+            if distance == 2 and size > 10_000:
+                # the delete index of 50k words at distance 2 is a few million keys
+                continue
+            words = [(random_word(rng), distance) for _ in range(size)]
+            build = timeit.timeit(lambda: FuzzyIndex(words), number=1)
+            index = FuzzyIndex(words)
+
+            lookup = timeit.timeit(lambda: [index.lookup(t) for t in tokens], number=1) / REPEAT
+            print(f"{size:>8} {distance:>9} {lookup * 1e6:>12.1f} {build:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
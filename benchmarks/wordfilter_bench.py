@@ -0,0 +1,46 @@
+"""
+Compares the word filter automaton against the old per word substring loop.
+
+Run from the repository root with Red installed:
+
+    python -m benchmarks.wordfilter_bench
+"""
+import random
+import string
+import timeit
+
+from automod.matching import AhoCorasick
+
+SIZES = (10, 1_000, 50_000)
+REPEAT = 200
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+
+
+def loop_filter(sentence: str, words: [str]) -> bool:
+    for word in words:
+        if word in sentence:
+            return True
+    return False
+
+
+def main():
+    rng = random.Random(1)
+    # no filtered word appears in the message, the worst case for both approaches
+    sentence = " ".join(random_word(rng) for _ in range(40)).replace("e", "3")
+
+    print(f"{'words':>8} {'loop (µs)':>12} {'automaton (µs)':>16} {'build (ms)':>12}")
+    for size in SIZES:
+        words = [random_word(rng).replace("3", "e") + "e" for _ in range(size)]
+        build = timeit.timeit(lambda: AhoCorasick(words), number=1)
+        matcher = AhoCorasick(words)
+
+        loop = timeit.timeit(lambda: loop_filter(sentence, words), number=REPEAT) / REPEAT
+        automaton = timeit.timeit(lambda: matcher.search(sentence), number=REPEAT) / REPEAT
+        print(f"{size:>8} {loop * 1e6:>12.1f} {automaton * 1e6:>16.1f} {build * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Digest embeds stay within what discord accepts however many offenders and channels they cover.
+"""
+import discord
+
+from automod.announcements import Announcement, digest_embed
+
+
+class FakeAuthor:
+    def __init__(self, author_id: int):
+        self.id = author_id
+
+    def __str__(self):
+        return f"{'x' * 32}#{self.id % 10000:04}"
+
+
+def announcements(members: int, per_member: int, channels: int) -> [Announcement]:
+    return [
+        Announcement(
+            embed=None,
+            author=FakeAuthor(10 ** 17 + member),
+            rule_names=["wordfilter", "spamrule", "mentionspamrule"],
+            action_taken="mute",
+            action_taken_success=i % 2 == 0,
+            deleted=True,
+            channel_id=10 ** 17 + i % channels,
+        )
+        for member in range(members)
+        for i in range(per_member)
+    ]
+
+
+def test_digest_of_many_offenders_in_many_channels_stays_under_the_embed_limit():
+    embed = digest_embed(announcements(members=40, per_member=60, channels=50), 60)
+    assert len(embed) <= 6000
+    assert len(embed.fields) <= 25
+    assert all(len(field.value) <= 1024 for field in embed.fields)
+    overflow = embed.fields[-1]
+    assert overflow.name == "And more"
+    shown = len(embed.fields) - 1
+    # cut by length before running out of fields
+    assert shown < 24
+    assert overflow.value.startswith(f"{40 - shown} more members")
+
+
+def test_long_channel_lists_are_cut():
+    embed = digest_embed(announcements(members=2, per_member=20, channels=20), 60)
+    assert len(embed.fields) == 2
+    assert all(field.value.endswith("and 15 more") for field in embed.fields)
+
+
+def test_small_digest_lists_everyone():
+    embed = digest_embed(announcements(members=3, per_member=2, channels=2), 60)
+    assert [field.name.endswith("(×2)") for field in embed.fields] == [True] * 3
+    assert isinstance(embed, discord.Embed)
@@ -0,0 +1,193 @@
+"""
+DeleteBatcher against a stub of the HTTP layer: channels and messages that record the
+requests they would send and fail the way discord.py does.
+"""
+import asyncio
+import datetime
+
+import discord
+import pytest
+
+from automod.deletes import BULK_LIMIT, DeleteBatcher
+
+WINDOW = 0.01
+
+
+class FakeResponse:
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+def forbidden() -> discord.Forbidden:
+    return discord.Forbidden(FakeResponse(403, "Forbidden"), "Missing Permissions")
+
+
+def not_found() -> discord.NotFound:
+    return discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Message")
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int = 10, bulk_error: Exception = None):
+        self.id = channel_id
+        self.bulk_error = bulk_error
+        # one list of message ids per bulk request
+        self.bulk_requests = []
+        # message id per single delete request
+        self.single_requests = []
+
+    async def delete_messages(self, messages):
+        self.bulk_requests.append([m.id for m in messages])
+        if self.bulk_error is not None:
+            raise self.bulk_error
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel: FakeChannel, age: datetime.timedelta = None, error=None):
+        self.id = message_id
+        self.channel = channel
+        self.created_at = datetime.datetime.utcnow() - (age or datetime.timedelta(seconds=1))
+        self.error = error
+
+    async def delete(self):
+        self.channel.single_requests.append(self.id)
+        if self.error is not None:
+            raise self.error
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def queue_all(batcher: DeleteBatcher, messages: [FakeMessage]) -> list:
+    futures = [batcher.queue(m) for m in messages]
+    return await asyncio.gather(*futures, return_exceptions=True)
+
+
+def test_batches_are_split_at_the_bulk_limit():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel()
+        messages = [FakeMessage(i, channel) for i in range(BULK_LIMIT + 50)]
+        results = await queue_all(batcher, messages)
+        return batcher, channel, results
+
+    batcher, channel, results = run(scenario())
+    assert [len(ids) for ids in channel.bulk_requests] == [BULK_LIMIT, 50]
+    assert sorted(i for ids in channel.bulk_requests for i in ids) == list(range(BULK_LIMIT + 50))
+    assert channel.single_requests == []
+    assert results == [None] * (BULK_LIMIT + 50)
+
+
+def test_old_messages_are_deleted_one_by_one():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel()
+        recent = [FakeMessage(i, channel) for i in range(3)]
+        old = [FakeMessage(i, channel, age=datetime.timedelta(days=15)) for i in range(3, 5)]
+        results = await queue_all(batcher, recent + old)
+        return channel, results
+
+    channel, results = run(scenario())
+    assert channel.bulk_requests == [[0, 1, 2]]
+    assert channel.single_requests == [3, 4]
+    assert results == [None] * 5
+
+
+def test_single_message_is_not_bulk_deleted():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel()
+        await batcher.delete(FakeMessage(1, channel))
+        return channel
+
+    channel = run(scenario())
+    assert channel.bulk_requests == []
+    assert channel.single_requests == [1]
+
+
+def test_failed_bulk_request_falls_back_to_single_deletes():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel(bulk_error=not_found())
+        messages = [FakeMessage(i, channel) for i in range(4)]
+        # one message was already deleted by someone else
+        messages[2].error = not_found()
+        results = await queue_all(batcher, messages)
+        return batcher, channel, results
+
+    batcher, channel, results = run(scenario())
+    assert channel.bulk_requests == [[0, 1, 2, 3]]
+    assert channel.single_requests == [0, 1, 2, 3]
+    assert results[0] is None and results[1] is None and results[3] is None
+    assert isinstance(results[2], discord.NotFound)
+    assert batcher.stats()["api_calls"] == 5
+
+
+def test_forbidden_bulk_request_reaches_every_waiter():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel(bulk_error=forbidden())
+        results = await queue_all(batcher, [FakeMessage(i, channel) for i in range(5)])
+        return channel, results
+
+    channel, results = run(scenario())
+    assert len(channel.bulk_requests) == 1
+    # no point retrying one by one without permissions
+    assert channel.single_requests == []
+    assert len(results) == 5
+    assert all(isinstance(result, discord.Forbidden) for result in results)
+
+
+def test_delete_raises_the_error_of_its_message():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel()
+        with pytest.raises(discord.Forbidden):
+            await batcher.delete(FakeMessage(1, channel, error=forbidden()))
+
+    run(scenario())
+
+
+def test_channels_are_batched_separately():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        first, second = FakeChannel(10), FakeChannel(11)
+        messages = [FakeMessage(i, first if i % 2 else second) for i in range(10)]
+        await queue_all(batcher, messages)
+        return first, second
+
+    first, second = run(scenario())
+    assert first.bulk_requests == [[1, 3, 5, 7, 9]]
+    assert second.bulk_requests == [[0, 2, 4, 6, 8]]
+
+
+def test_counters():
+    async def scenario():
+        batcher = DeleteBatcher(window=WINDOW)
+        channel = FakeChannel()
+        recent = [FakeMessage(i, channel) for i in range(120)]
+        old = [FakeMessage(i, channel, age=datetime.timedelta(days=20)) for i in range(120, 122)]
+        pending = [batcher.queue(m) for m in recent + old]
+        during = batcher.stats()
+        await asyncio.gather(*pending)
+        return during, batcher.stats()
+
+    during, after = run(scenario())
+    # the first 100 went out as soon as the batch was full
+    assert during["pending"] == 22
+    # bulk of 100, bulk of 20, two single deletes of old messages
+    assert after == {"requested": 122, "api_calls": 4, "saved": 118, "pending": 0}
+
+
+def test_cancel_cancels_waiters():
+    async def scenario():
+        batcher = DeleteBatcher(window=10)
+        channel = FakeChannel()
+        future = batcher.queue(FakeMessage(1, channel))
+        batcher.cancel()
+        return future, channel
+
+    future, channel = run(scenario())
+    assert future.cancelled()
+    assert channel.bulk_requests == [] and channel.single_requests == []
@@ -0,0 +1,104 @@
+"""
+ActionExecutor admission when full: no guild may starve the others and urgent jobs go last.
+
+Jobs are submitted without yielding to the event loop, so the workers never take any and the
+queue state after submitting is exactly what admission left behind.
+"""
+import asyncio
+
+from automod.executor import ActionExecutor, LANE_ANNOUNCE, LANE_DELETE, LANE_PUNISH
+
+
+async def job():
+    pass
+
+
+def queued(executor: ActionExecutor, guild_id: int, lane: int) -> int:
+    lanes = executor._queues.get(guild_id)
+    return 0 if lanes is None else len(lanes[lane])
+
+
+def scenario(test):
+    async def run():
+        executor = ActionExecutor(workers=1, max_size=10, max_per_guild=6)
+        try:
+            test(executor)
+        finally:
+            executor.cancel()
+
+    asyncio.run(run())
+
+
+def test_stuck_guild_does_not_starve_others():
+    def test(executor):
+        accepted = [executor.submit(1, LANE_PUNISH, job) for _ in range(100)]
+        assert accepted.count(True) == 6
+        assert all(executor.submit(2, LANE_PUNISH, job) for _ in range(4))
+        assert queued(executor, 2, LANE_PUNISH) == 4
+
+    scenario(test)
+
+
+def test_guild_at_its_cap_makes_room_from_its_own_lower_lanes():
+    def test(executor):
+        for _ in range(6):
+            executor.submit(1, LANE_ANNOUNCE, job)
+        assert executor.submit(1, LANE_PUNISH, job)
+        assert queued(executor, 1, LANE_ANNOUNCE) == 5
+        assert queued(executor, 1, LANE_PUNISH) == 1
+        assert not executor.submit(1, LANE_ANNOUNCE, job)
+
+    scenario(test)
+
+
+def test_full_queue_drops_the_least_urgent_job_of_the_biggest_backlog():
+    def test(executor):
+        for guild_id, count in ((1, 6), (2, 4)):
+            for _ in range(count):
+                executor.submit(guild_id, LANE_ANNOUNCE, job)
+        assert executor.submit(3, LANE_PUNISH, job)
+        assert queued(executor, 1, LANE_ANNOUNCE) == 5
+        assert queued(executor, 2, LANE_ANNOUNCE) == 4
+        assert executor.size == 10
+
+    scenario(test)
+
+
+def test_urgent_jobs_are_never_dropped_while_less_urgent_ones_are_queued():
+    def test(executor):
+        for _ in range(6):
+            executor.submit(1, LANE_PUNISH, job)
+        for _ in range(4):
+            executor.submit(2, LANE_ANNOUNCE, job)
+        # guild 1 has the bigger backlog but only punish jobs, guild 2's announcements go first
+        assert executor.submit(3, LANE_DELETE, job)
+        assert queued(executor, 1, LANE_PUNISH) == 6
+        assert queued(executor, 2, LANE_ANNOUNCE) == 3
+
+    scenario(test)
+
+
+def test_new_job_is_dropped_when_everything_queued_is_more_urgent():
+    def test(executor):
+        for guild_id in (1, 2):
+            for _ in range(5):
+                executor.submit(guild_id, LANE_PUNISH, job)
+        assert not executor.submit(3, LANE_ANNOUNCE, job)
+        assert 3 not in executor._queues
+        assert executor.stats()["dropped"] == 1
+
+    scenario(test)
+
+
+def test_same_lane_makes_room_only_from_a_bigger_backlog():
+    def test(executor):
+        for _ in range(6):
+            executor.submit(1, LANE_DELETE, job)
+        for _ in range(4):
+            executor.submit(2, LANE_DELETE, job)
+        assert executor.submit(3, LANE_DELETE, job)
+        assert queued(executor, 1, LANE_DELETE) == 5
+        # guild 1 now has 5 queued against guild 2's 4, guild 2 doesn't evict it for a 5th
+        assert not executor.submit(2, LANE_DELETE, job)
+
+    scenario(test)
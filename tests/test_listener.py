@@ -0,0 +1,218 @@
+"""
+The message listener against an in-memory config and bare stand-ins for guilds and messages.
+
+Jobs handed to the action executor are recorded instead of run, so a test sees which rules a
+message broke without any request going out.
+"""
+import asyncio
+import copy
+import datetime
+
+import discord
+import pytest
+from redbot.core import Config
+
+import automod.main
+
+
+class MemoryGroup:
+    def __init__(self, defaults: dict, data: dict):
+        self.defaults = defaults
+        self.data = data
+
+    async def all(self) -> dict:
+        return {**copy.deepcopy(self.defaults), **copy.deepcopy(self.data)}
+
+    async def get_raw(self, *keys):
+        value = await self.all()
+        for key in keys:
+            value = value[key]
+        return value
+
+    async def set_raw(self, *keys, value):
+        data = self.data
+        for key in keys[:-1]:
+            data = data.setdefault(key, copy.deepcopy(self.defaults.get(key, {})) if data is self.data else {})
+        data[keys[-1]] = copy.deepcopy(value)
+
+    async def clear_raw(self, *keys):
+        data = self.data
+        for key in keys[:-1]:
+            data = data.setdefault(key, {})
+        data.pop(keys[-1], None)
+
+
+class MemoryConfig:
+    def __init__(self):
+        self.defaults = {}
+        self.guilds = {}
+
+    def register_guild(self, **defaults):
+        self.defaults.update(defaults)
+
+    def register_member(self, **defaults):
+        pass
+
+    def guild(self, guild) -> MemoryGroup:
+        return MemoryGroup(self.defaults, self.guilds.setdefault(guild.id, {}))
+
+
+class Bot:
+    def __init__(self):
+        self.guilds = []
+
+    async def is_automod_immune(self, member) -> bool:
+        return False
+
+    def dispatch(self, *args):
+        pass
+
+    def get_guild(self, guild_id):
+        return None
+
+
+class Stub:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+@pytest.fixture
+def with_cog(monkeypatch, tmp_path):
+    """Runs `scenario(cog)` on a fresh cog and returns the cog once it was unloaded"""
+    monkeypatch.setattr(Config, "get_conf", staticmethod(lambda *args, **kwargs: MemoryConfig()))
+    monkeypatch.setattr(automod.main, "cog_data_path", lambda *args, **kwargs: tmp_path)
+
+    def run(scenario):
+        async def main():
+            cog = automod.main.AutoMod(Bot())
+            cog.submitted = []
+            cog.executor.submit = lambda guild_id, lane, job: cog.submitted.append(job.args[0])
+            try:
+                await scenario(cog)
+            finally:
+                cog.cog_unload()
+                await asyncio.sleep(0)
+            return cog
+
+        return asyncio.run(main())
+
+    return run
+
+
+def make_guild(guild_id: int = 100):
+    guild = Stub(id=guild_id, owner_id=1, me=Stub(id=1, guild_permissions=discord.Permissions.none()))
+    guild.default_role = Stub(id=guild_id, position=0)
+    guild.channel = Stub(id=10, guild=guild)
+    return guild
+
+
+def make_message(guild, content: str, message_id: int, author_id: int = 5):
+    author = Stub(id=author_id, bot=False, guild=guild, roles=[guild.default_role], top_role=guild.default_role)
+    return Stub(
+        id=message_id,
+        guild=guild,
+        channel=guild.channel,
+        author=author,
+        content=content,
+        created_at=datetime.datetime.utcnow(),
+        mentions=[],
+        raw_mentions=[],
+    )
+
+
+def test_spam_counters_advance_after_a_ban_hit(with_cog):
+    guild = make_guild()
+
+    async def scenario(cog):
+        group = cog.config.guild(guild)
+        await group.set_raw("MaxCharsRule", "is_enabled", value=True)
+        await group.set_raw("MaxCharsRule", "max_chars", value=10)
+        await group.set_raw("MaxCharsRule", "action_to_take", value="ban")
+        await group.set_raw("MaxCharsRule", "delete_message", value=True)
+        await group.set_raw("SpamRule", "is_enabled", value=True)
+        await group.set_raw("SpamRule", "user_limit", value=[3, 60])
+        await cog.plans.invalidate(guild)
+
+        for i in range(4):
+            await cog._listen_for_infractions(make_message(guild, "long enough to ban " * 3, 1000 + i))
+
+    cog = with_cog(scenario)
+    assert [actions.action_to_take for actions in cog.submitted] == ["ban"] * 4
+    # the first three messages stay within the spam limit, the fourth breaks it although the ban was known
+    assert [actions.rule_names for actions in cog.submitted] == [["MaxCharsRule"]] * 3 + [
+        ["MaxCharsRule", "SpamRule"]
+    ]
+    assert cog.spamrule.stats()["size"] > 0
+
+
+def test_rules_without_state_or_purge_are_skipped_after_a_ban_hit(with_cog):
+    guild = make_guild()
+
+    async def scenario(cog):
+        group = cog.config.guild(guild)
+        await group.set_raw("MaxCharsRule", "is_enabled", value=True)
+        await group.set_raw("MaxCharsRule", "max_chars", value=10)
+        await group.set_raw("MaxCharsRule", "action_to_take", value="ban")
+        await group.set_raw("MaxCharsRule", "delete_message", value=True)
+        await group.set_raw("MaxWordsRule", "is_enabled", value=True)
+        await group.set_raw("MaxWordsRule", "max_words", value=2)
+        await cog.plans.invalidate(guild)
+
+        await cog._listen_for_infractions(make_message(guild, "long enough to ban " * 3, 2000))
+
+    cog = with_cog(scenario)
+    assert [actions.rule_names for actions in cog.submitted] == [["MaxCharsRule"]]
+
+
+def test_configured_plan_is_available_during_a_raid(with_cog):
+    guild = make_guild()
+
+    async def scenario(cog):
+        await cog.config.guild(guild).set_raw("MaxCharsRule", "is_enabled", value=True)
+        await cog.plans.invalidate(guild)
+        cog.plans.set_raid(guild.id, True)
+        raided = await cog.plans.get(guild)
+        configured = await cog.plans.get(guild, raid=False)
+        assert raided.is_raid and raided.get_rule("MaxCharsRule").delete_message
+        assert not configured.is_raid and not configured.get_rule("MaxCharsRule").delete_message
+
+    with_cog(scenario)
+
+
+def test_regex_timeouts_are_not_memoized(with_cog):
+    guild = make_guild()
+    word = {"word": "(a|aa)+$", "is_cleaned": False, "is_regex": True, "channel": [], "author": 1}
+
+    async def scenario(cog):
+        await cog.config.guild(guild).set_raw("WordFilterRule", "is_enabled", value=True)
+        await cog.config.guild(guild).set_raw("WordFilterRule", "words", value=[word])
+        await cog.plans.invalidate(guild)
+
+        for i in range(2):
+            await cog._listen_for_infractions(make_message(guild, "a" * 40 + "b", 3000 + i))
+
+    cog = with_cog(scenario)
+    # the second copy was searched again instead of reusing the first one's verdict
+    assert cog.wordfilterrule.pattern_timeouts == 2
+    assert cog.verdicts.stats()["rules"]["WordFilterRule"] == (0, 2)
+    assert cog.submitted == []
+
+
+def test_allowed_invites_are_matched_by_code(with_cog):
+    guild = make_guild()
+
+    async def scenario(cog):
+        await cog.config.guild(guild).set_raw("DiscordInviteRule", "is_enabled", value=True)
+        await cog.inviterule.add_allowed_link(guild, "discord.gg/friends")
+
+        for i, content in enumerate(
+            [
+                "join https://discord.gg/friends",
+                "join https://discordapp.com/invite/friends",
+                "join discord.gg/strangers",
+            ]
+        ):
+            await cog._listen_for_infractions(make_message(guild, content, 4000 + i))
+
+    cog = with_cog(scenario)
+    assert [actions.rule_names for actions in cog.submitted] == [["DiscordInviteRule"]]
@@ -0,0 +1,42 @@
+"""
+CombinedPattern keeps to its time budget, also when every worker thread is busy.
+"""
+import asyncio
+import time
+
+import pytest
+
+from automod import patterns
+from automod.patterns import CombinedPattern, PatternTimeout
+
+
+def test_match_and_no_match():
+    async def scenario():
+        pattern = CombinedPattern([r"fr[e3]+ n[i1]tro", r"\bfoo\b"])
+        return await pattern.search("get FREE nitro here"), await pattern.search("nothing to see")
+
+    assert asyncio.run(scenario()) == ("FREE nitro", None)
+
+
+def test_backtracking_search_times_out():
+    async def scenario():
+        # nested repetition is rejected when words are added, this only checks the budget holds
+        pattern = CombinedPattern([r"(a|aa)+$"])
+        with pytest.raises(PatternTimeout):
+            await pattern.search("a" * 40 + "b")
+
+    asyncio.run(scenario())
+
+
+def test_queued_search_times_out_while_the_workers_are_busy():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        busy = [loop.run_in_executor(patterns._executor, time.sleep, 0.5) for _ in range(2)]
+        started = time.monotonic()
+        with pytest.raises(PatternTimeout):
+            await CombinedPattern(["spam"]).search("spam")
+        waited = time.monotonic() - started
+        await asyncio.gather(*busy)
+        return waited
+
+    assert asyncio.run(scenario()) < 0.4
@@ -0,0 +1,53 @@
+"""
+GCRALimiter at realistic epoch timestamps, where float rounding used to flag the last allowed message.
+"""
+import random
+import time
+
+import pytest
+
+from automod.ratelimit import GCRALimiter
+
+LIMITS = [(10, 12.0), (15, 17.0), (3, 7.0), (5, 5.0), (8, 30.0)]
+
+
+def timestamps(count: int = 200) -> [float]:
+    rng = random.Random(0)
+    now = time.time()
+    return [now] + [now + rng.uniform(-1e7, 1e7) for _ in range(count)]
+
+
+@pytest.mark.parametrize("rate, per", LIMITS)
+def test_rate_messages_in_a_burst_are_allowed(rate, per):
+    for start in timestamps():
+        limiter = GCRALimiter(rate, per, max_size=10)
+        flagged = [limiter.hit("author", start) for _ in range(rate)]
+        assert not any(flagged), f"flagged within the limit at {start!r}"
+        assert limiter.hit("author", start), f"not flagged over the limit at {start!r}"
+
+
+@pytest.mark.parametrize("rate, per", LIMITS)
+def test_rate_messages_spread_over_the_period_are_allowed(rate, per):
+    for start in timestamps():
+        limiter = GCRALimiter(rate, per, max_size=10)
+        step = per / rate / 10
+        flagged = [limiter.hit("author", start + i * step) for i in range(rate)]
+        assert not any(flagged), f"flagged within the limit at {start!r}"
+
+
+@pytest.mark.parametrize("rate, per", LIMITS)
+def test_limit_recovers_after_the_period(rate, per):
+    start = time.time()
+    limiter = GCRALimiter(rate, per, max_size=10)
+    for _ in range(rate):
+        limiter.hit("author", start)
+    assert not limiter.hit("author", start + per)
+
+
+def test_keys_are_limited_separately():
+    start = time.time()
+    limiter = GCRALimiter(2, 10.0, max_size=10)
+    assert not limiter.hit("first", start)
+    assert not limiter.hit("first", start)
+    assert limiter.hit("first", start)
+    assert not limiter.hit("second", start)